@@ -0,0 +1,114 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import soundfile as sf
+
+from src.config import MASTER_CSV_COLUMNS
+
+"""
+Synthetic stand-ins for AudioMoth recordings and BirdNET exports, so benchmarks run offline on any machine.
+Everything is generated from a fixed seed so runs are comparable.
+"""
+
+SEED = 6013
+
+#(name, seconds, sample rate)
+WAV_FIXTURES = [
+    ("short_48k", 60, 48000),
+    ("long_48k", 600, 48000),
+    ("long_22k", 600, 22050),
+]
+
+#(name, rows)
+CSV_FIXTURES = [
+    ("season_small", 20000),
+    ("season_large", 200000),
+]
+
+SPECIES = [
+    ("Alauda arvensis", "Eurasian Skylark"),
+    ("Emberiza citrinella", "Yellowhammer"),
+    ("Carduelis carduelis", "European Goldfinch"),
+    ("Linaria cannabina", "Eurasian Linnet"),
+    ("Erithacus rubecula", "European Robin"),
+    ("Muscicapa striata", "Spotted Flycatcher"),
+    ("Prunella modularis", "Dunnock"),
+    ("Pica pica", "Eurasian Magpie"),
+]
+
+LOCATIONS = ["Hedgerow North", "North Control Grassland"]
+
+
+def make_wav(path, seconds, sample_rate, calls_per_minute=6):
+    """Low level background noise with short rising chirps dotted through it, like a quiet field recording."""
+    rng = np.random.default_rng(SEED)
+    audio = (rng.standard_normal(int(seconds*sample_rate)) * 0.01).astype(np.float32)
+
+    call = int(0.4*sample_rate)
+    t = np.arange(call)/sample_rate
+    top = min(8000, sample_rate/2 - 500)
+    chirp = (0.3*np.sin(2*np.pi*(2000*t + (top - 2000)/(2*t[-1])*t**2)) * np.hanning(call)).astype(np.float32)
+
+    for start in rng.integers(0, len(audio) - call, int(seconds/60*calls_per_minute)):
+        audio[start:start+call] += chirp
+
+    sf.write(path, audio, sample_rate, subtype="PCM_16")
+    return path
+
+
+def make_birdnet_csv(path, rows, start=datetime(2024, 6, 1, 4, 0)):
+    """
+    Full-season style BirdNET export in the master layout decompile_csv reads (MASTER_CSV_COLUMNS),
+    "dd/mm/yyyy hh:mm" start/end and rows from each of LOCATIONS.
+    """
+    rng = np.random.default_rng(SEED)
+    minutes = np.sort(rng.integers(0, 60*24*90, rows))
+    species = rng.integers(0, len(SPECIES), rows)
+    confidence = rng.uniform(0.1, 1.0, rows)
+    locations = rng.integers(0, len(LOCATIONS), rows)
+
+    def master_row(columns):
+        row = [None]*len(MASTER_CSV_COLUMNS)
+        for column, value in enumerate(columns):
+            row[MASTER_CSV_COLUMNS[column]] = value
+        return row
+
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(master_row(["Start (s)", "End (s)", "Location", "Scientific name", "Common name", "Confidence"]))
+        for minute, code, conf, location in zip(minutes, species, confidence, locations):
+            time = (start + timedelta(minutes=int(minute))).strftime("%d/%m/%Y %H:%M")
+            writer.writerow(master_row([time, time, LOCATIONS[location], SPECIES[code][0], SPECIES[code][1], f"{conf:.4f}"]))
+
+    return path
+
+
+def build_fixtures(directory, quick=False):
+    """
+    Writes any fixtures missing from directory.
+
+    Returns
+        ({wav name: path}, {csv name: path})
+    """
+    os.makedirs(directory, exist_ok=True)
+    wavs, csvs = {}, {}
+
+    for name, seconds, sample_rate in WAV_FIXTURES:
+        if quick and name.startswith("long"):
+            continue
+        path = os.path.join(directory, f"{name}_20240605_184000.wav")
+        if not os.path.exists(path):
+            make_wav(path, seconds, sample_rate)
+        wavs[name] = path
+
+    for name, rows in CSV_FIXTURES:
+        if quick and name.endswith("large"):
+            continue
+        path = os.path.join(directory, f"{name}.csv")
+        if not os.path.exists(path):
+            make_birdnet_csv(path, rows)
+        csvs[name] = path
+
+    return wavs, csvs
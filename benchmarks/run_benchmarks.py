@@ -0,0 +1,214 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fixtures import build_fixtures
+from benchmarks.startup import check_budgets
+from scripts import split_csv_files
+from scripts.label_spectrograms import chunk_spectrogram
+from src.AudioLoader import load_audio
+from src.SpectrogramStore import SpectrogramStore
+from src.WavController import WavController
+
+"""
+Times and memory-profiles each stage of the pipeline on synthetic recordings and BirdNET CSVs,
+and compares the results against a saved baseline.
+
+    python -m benchmarks.run_benchmarks --update-baseline     (on the main branch)
+    python -m benchmarks.run_benchmarks --threshold 0.2       (on your branch, exits 1 on a regression)
+
+Baselines are machine specific, so only compare runs made on the same machine.
+"""
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+FIXTURE_DIR = os.path.join(tempfile.gettempdir(), "birdnet_benchmark_fixtures")
+
+#Timings under this are mostly noise, they aren't counted as regressions
+MIN_SECONDS = 0.005
+
+#Number of chunk starts compute_spec is timed on
+LABELLER_CHUNKS = 20
+
+
+def measure(func, repeat=3):
+    """
+    Best of repeat wall times, then one more run under tracemalloc for the peak Python/numpy allocation.
+    The memory run is separate since tracemalloc slows everything down.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": min(times), "peak_bytes": peak}
+
+
+def controller(audio, sample_rate, store):
+    """WavController over already decoded audio, so stage timings don't include decoding."""
+    wav_controller = WavController(store=store)
+    wav_controller.audio_data, wav_controller.sample_rate = audio, sample_rate
+    return wav_controller
+
+
+def wav_benchmarks(wav_path, store):
+    """name -> callable for every audio stage on one recording."""
+    audio, sample_rate = load_audio(wav_path, sr=None, cache=False)
+    wav_controller = controller(audio, sample_rate, store)
+    chunks = wav_controller.make_chunks(overlap=True)
+    duration = len(audio)/sample_rate
+
+    def stream_chunks():
+        for _ in WavController(wav_path, stream=True, store=store).make_chunks():
+            pass
+
+    def create_spectrogram():
+        for chunk in chunks:
+            wav_controller.create_spectrogram(chunk)
+
+    def compute_spec():
+        #Same path as a labeller cache miss: seek-read the padded chunk and compute its dB mel spectrogram
+        step = max(1.0, (duration - 3)/LABELLER_CHUNKS)
+        for i in range(LABELLER_CHUNKS):
+            chunk_spectrogram(wav_path, min(i*step, duration - 3))
+
+    return {
+        "load_audio": lambda: load_audio(wav_path, sr=None, cache=False),
+        "make_chunks": lambda: wav_controller.make_chunks(overlap=True),
+        "make_chunks_stream": stream_chunks,
+        "detect_activity": wav_controller.detect_activity,
+        "create_spectrogram": create_spectrogram,
+        "create_spectrogram_batch": wav_controller.create_spectrogram_batch,
+        "compute_spec": compute_spec,
+    }
+
+
+def csv_benchmarks(csv_path):
+    """name -> callable for the CSV stages on one BirdNET export."""
+    with open(csv_path, encoding="utf-8-sig") as f:
+        next(f)
+        timestamps = [line.split(",", 1)[0].split(" ") for line in f]
+
+    def get_file_name():
+        for date, time_of_day in timestamps:
+            split_csv_files.get_file_name(date, time_of_day)
+
+    return {
+        "read_csv": lambda: split_csv_files.read_csv(csv_path),
+        "get_file_name": get_file_name,
+    }
+
+
+def run(fixture_dir=FIXTURE_DIR, repeat=3, quick=False, only=None):
+    wavs, csvs = build_fixtures(fixture_dir, quick)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = SpectrogramStore(store_dir)
+
+        stages = []
+        for name, wav_path in wavs.items():
+            stages += [(f"{stage}@{name}", func) for stage, func in wav_benchmarks(wav_path, store).items()]
+        for name, csv_path in csvs.items():
+            stages += [(f"{stage}@{name}", func) for stage, func in csv_benchmarks(csv_path).items()]
+
+        for key, func in stages:
+            if only and not any(stage in key for stage in only):
+                continue
+            results[key] = measure(func, repeat)
+            print(f"{key:45s} {results[key]['seconds']*1000:10.1f} ms {results[key]['peak_bytes']/1024**2:10.1f} MB")
+
+    return results
+
+
+def machine():
+    return {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(),
+            "cpus": os.cpu_count()}
+
+
+def save_baseline(results, path=BASELINE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"machine": machine(), "results": results}, f, indent=1, sort_keys=True)
+
+
+def load_baseline(path=BASELINE):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Stages that got more than threshold (as a fraction) slower or hungrier than the baseline.
+
+    Returns
+        list of (stage, measure, baseline value, new value)
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        old = baseline[key]
+        if result["seconds"] > old["seconds"]*(1 + threshold) and result["seconds"] > MIN_SECONDS:
+            regressions.append((key, "seconds", old["seconds"], result["seconds"]))
+        if result["peak_bytes"] > old["peak_bytes"]*(1 + threshold):
+            regressions.append((key, "peak_bytes", old["peak_bytes"], result["peak_bytes"]))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic recordings and CSVs")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown/extra memory, 0.2 = 20%%")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="skip the long fixtures")
+    parser.add_argument("--only", nargs="*", help="only run stages whose name contains one of these")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="where the synthetic fixtures are generated")
+    args = parser.parse_args()
+
+    results = run(args.fixtures, args.repeat, args.quick, args.only)
+
+    #Import times are checked against fixed budgets as well as the baseline
+    startup, over_budget = check_budgets(repeat=args.repeat)
+    for module, seconds in startup.items():
+        results[f"import@{module}"] = {"seconds": seconds, "peak_bytes": 0}
+        print(f"{'import@' + module:45s} {seconds*1000:10.1f} ms")
+    for module, seconds, budget in over_budget:
+        print(f"OVER BUDGET import {module}: {seconds:.2f}s > {budget:.2f}s")
+
+    if args.update_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline first")
+        sys.exit(1 if over_budget else 0)
+
+    baseline = load_baseline(args.baseline)
+    if baseline["machine"] != machine():
+        print("Warning: baseline was recorded on a different machine, timings may not be comparable")
+
+    regressions = compare(results, baseline["results"], args.threshold)
+    for key, measured, old, new in regressions:
+        print(f"REGRESSION {key} {measured}: {old:.4g} -> {new:.4g} ({new/old - 1:+.0%})")
+
+    sys.exit(1 if regressions or over_budget else 0)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import subprocess
+import sys
+
+"""
+Startup budget: how long importing each entry point takes in a fresh interpreter, measured with python -X importtime.
+The labeller's window can't appear until its module has imported, so this is most of its startup time.
+
+    python -m benchmarks.startup
+"""
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Seconds each module may take to import
+STARTUP_BUDGETS = {
+    "scripts.labelling_audio": 1.5,
+    "src.WavController": 1.0,
+}
+
+
+def import_seconds(module, repeat=3):
+    """Best of repeat cumulative import times for module, each in a new interpreter so nothing is already imported."""
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+
+        #Lines look like "import time:  self [us] | cumulative | package", the module's own line is the total
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                times.append(int(parts[1])/1e6)
+                break
+        else:
+            raise RuntimeError(f"No import time found for {module}")
+
+    return min(times)
+
+
+def check_budgets(budgets=STARTUP_BUDGETS, repeat=3):
+    """
+    Returns
+        ({module: seconds}, list of (module, seconds, budget) over budget)
+    """
+    times = {module: import_seconds(module, repeat) for module in budgets}
+    over = [(module, times[module], budget) for module, budget in budgets.items() if times[module] > budget]
+
+    return times, over
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check module import times against their startup budgets")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    times, over = check_budgets(repeat=args.repeat)
+    for module, seconds in times.items():
+        print(f"{module:30s} {seconds*1000:8.0f} ms (budget {STARTUP_BUDGETS[module]*1000:.0f} ms)")
+    for module, seconds, budget in over:
+        print(f"OVER BUDGET {module}: {seconds:.2f}s > {budget:.2f}s")
+
+    sys.exit(1 if over else 0)
@@ -1,14 +1,27 @@
 import csv
+import io
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
-from src.config import CSV_DATA, DATA_PATH
+from src.config import CSV_DATA, DATA_PATH, FULL_CSV, CSV_LOCATION, MASTER_CSV_COLUMNS
+from src.Instrumentation import timed
 
 """
 I was provided with a huge CSV containing all data from all PAM recording locations; this splits them up by location
+
+    python -m scripts.decompile_csv all_sites.csv "North Control Grassland" "Hedgerow North"
 """
 
-def read_csv(file_path):
-    locations = ["North Control Grassland", "Hedgerow North"]
+LOCATION_COLUMN = MASTER_CSV_COLUMNS[CSV_LOCATION]
+DEFAULT_LOCATIONS = ["North Control Grassland", "Hedgerow North"]
+
+#Size of each piece of the file handed to a worker, small enough that a worker never holds much of the file at once
+RANGE_BYTES = 64 * 1024**2
+
+@timed("read_csv", file_arg=0)
+def read_csv(file_path, locations=DEFAULT_LOCATIONS):
     csv_files = {}
 
     with open(file_path, newline="", encoding="UTF-8") as compiled:
@@ -17,19 +30,86 @@ def read_csv(file_path):
         info_line = ",".join(next(reader))
 
         for instance in reader:
-            if instance[5] not in locations:
+            if instance[LOCATION_COLUMN] not in locations:
                 continue
 
-            if instance[5] not in csv_files:
-                csv_files[instance[5]] = [instance]
+            if instance[LOCATION_COLUMN] not in csv_files:
+                csv_files[instance[LOCATION_COLUMN]] = [instance]
             else:
-                csv_files[instance[5]].append(instance)
+                csv_files[instance[LOCATION_COLUMN]].append(instance)
+
+    return csv_files, info_line
+
+def byte_ranges(file_path, range_bytes=RANGE_BYTES):
+    """
+    Splits the file (after the header) into (start, end) byte ranges that begin and end on a line break.
+    Assumes no quoted field has a newline in it, which BirdNET's output doesn't.
+
+    Returns
+        info_line, list of (start, end)
+    """
+    size = os.path.getsize(file_path)
+
+    with open(file_path, "rb") as compiled:
+        header = compiled.readline()
+        info_line = ",".join(next(csv.reader([header.decode("utf-8-sig")])))
+
+        boundaries = [compiled.tell()]
+        while boundaries[-1] < size:
+            compiled.seek(min(size, boundaries[-1] + range_bytes))
+            #Move on to the start of the next line
+            compiled.readline()
+            boundaries.append(min(size, compiled.tell()))
+
+    return info_line, list(zip(boundaries[:-1], boundaries[1:]))
+
+def read_range(file_path, start, end, locations):
+    """Worker: rows from one byte range of the file whose location is in locations, grouped by location."""
+    with open(file_path, "rb") as compiled:
+        compiled.seek(start)
+        text = compiled.read(end - start).decode("utf-8")
+
+    csv_files = {}
+    for instance in csv.reader(io.StringIO(text, newline="")):
+        if instance and instance[LOCATION_COLUMN] in locations:
+            csv_files.setdefault(instance[LOCATION_COLUMN], []).append(instance)
+
+    return csv_files
+
+@timed("read_csv", file_arg=0)
+def read_csv_parallel(file_path, locations=DEFAULT_LOCATIONS, workers=None):
+    """
+    Same result as read_csv, but each byte range of the file is filtered in its own process.
+    Ranges are merged back in file order so rows keep their original order.
+    """
+    locations = set(locations)
+    info_line, ranges = byte_ranges(file_path)
+
+    csv_files = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(read_range, file_path, start, end, locations) for start, end in ranges]
+
+        for future in futures:
+            for location, instances in future.result().items():
+                csv_files.setdefault(location, []).extend(instances)
 
     return csv_files, info_line
 
-def create_csv(csv_files):
-    #Parse data into yyyyMMdd_hhmmss
-    pass
+def to_split_layout(instance):
+    """Master row -> the CSV_* column order split_csv_files and the labeller read, any extra columns are kept at the end."""
+    return [instance[MASTER_CSV_COLUMNS[column]] for column in sorted(MASTER_CSV_COLUMNS)] + instance[len(MASTER_CSV_COLUMNS):]
+
+@timed("write_csv")
+def create_csv(csv_files, info_line, out_dir=FULL_CSV):
+    """Writes one CSV per location to out_dir in the CSV_* layout, ready for split_csv_files to split into recordings."""
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    for location, instances in csv_files.items():
+        with (out_path / f"{location}.csv").open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(to_split_layout(info_line.split(",")))
+            writer.writerows(to_split_layout(instance) for instance in instances)
 
 
 
@@ -37,9 +117,13 @@ if __name__ == "__main__":
     filename = sys.argv[1]
     filepath = CSV_DATA + filename
 
-    csv_files, info_line = read_csv(filepath)
+    #Any further arguments are the locations to keep
+    locations = sys.argv[2:] or DEFAULT_LOCATIONS
+
+    csv_files, info_line = read_csv_parallel(filepath, locations)
 
     print(info_line)
     for file in csv_files:
-        for bird in csv_files[file]:
-            print (bird)
\ No newline at end of file
+        print(file, len(csv_files[file]))
+
+    create_csv(csv_files, info_line)
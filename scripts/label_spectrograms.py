@@ -0,0 +1,141 @@
+import os
+#Each worker process gets one core, stops numpy's BLAS threads fighting each other
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from matplotlib import image
+
+from src.AudioLoader import read_window
+from src.config import LABELS, LABEL_DB, YOLO_DATASET, TARGET_SAMPLE_RATE, CHUNK_SECONDS, N_FFT, HOP, N_MELS, MIN_FREQ, STFT_PAD, CLASSES
+from src.LabelDatabase import LabelDatabase
+from src.MelFrontend import get_frontend, power_to_db
+
+"""
+Builds a YOLO dataset from the boxes saved by the labeller: a spectrogram image and a .txt of boxes per labelled chunk.
+Entries are named after their recording and chunk start, and only rebuilt when the audio or its boxes change.
+
+    python -m scripts.label_spectrograms --workers 32
+"""
+
+MANIFEST_NAME = "manifest.json"
+
+
+def read_labels(db_path=LABEL_DB):
+    """
+    Every box in the label database, grouped by the chunk it was drawn on.
+
+    Returns
+        (wav path, t_start) -> list of (class, cx, cy, w, h)
+    """
+    label_db = LabelDatabase(db_path)
+    try:
+        return {(wav, t_start): boxes for wav, t_start, boxes in label_db.iter_chunks()}
+    finally:
+        label_db.close()
+
+
+def entry_name(wav_path, t_start):
+    """Deterministic name for a chunk, e.g. 20240605_184000_000123000 for 123s into 20240605_184000.WAV"""
+    stem = os.path.splitext(os.path.basename(wav_path))[0]
+    return f"{stem}_{int(round(t_start*1000)):09d}"
+
+
+def entry_signature(wav_path, boxes):
+    """Changes if the recording is replaced or the chunk's boxes change, so the entry needs rebuilding."""
+    stat = os.stat(wav_path)
+    key = json.dumps([stat.st_size, stat.st_mtime_ns, sorted(boxes)])
+
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def chunk_spectrogram(wav_path, t_start):
+    """dB mel spectrogram of the chunk, computed the same way as the labeller's compute_spec."""
+    padded_chunk, sample_rate = read_window(wav_path, t_start, t_start+CHUNK_SECONDS, sr=TARGET_SAMPLE_RATE, pad=STFT_PAD)
+    frontend = get_frontend(sample_rate, N_FFT, N_MELS, MIN_FREQ, min(sample_rate/2, 150000), HOP)
+
+    return power_to_db(frontend(padded_chunk, center=False))
+
+
+def export_entry(wav_path, t_start, boxes, out_dir):
+    """Worker: writes images/<name>.png and labels/<name>.txt for one chunk."""
+    name = entry_name(wav_path, t_start)
+    spec_db = chunk_spectrogram(wav_path, t_start)
+
+    #Image row 0 is the top, the highest mel band, same as YOLO's origin
+    image.imsave(os.path.join(out_dir, "images", name + ".png"), np.flipud(spec_db), cmap="magma",
+                 vmin=float(spec_db.min()), vmax=float(spec_db.max()))
+
+    with open(os.path.join(out_dir, "labels", name + ".txt"), "w", encoding="utf-8") as f:
+        for label, cx, cy, w, h in boxes:
+            cx, cy, w, h = (min(1.0, max(0.0, value)) for value in (cx, cy, w, h))
+            f.write(f"{CLASSES.index(label)} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n")
+
+    return name
+
+
+def export_dataset(chunks, out_dir=YOLO_DATASET, workers=None):
+    """
+    Exports every chunk over a process pool, skipping entries whose signature hasn't changed since the last export.
+    Entries whose chunk no longer has any boxes are removed.
+
+    Returns
+        (number rebuilt, number unchanged, number removed)
+    """
+    for sub_dir in ("images", "labels"):
+        os.makedirs(os.path.join(out_dir, sub_dir), exist_ok=True)
+
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    signatures = {entry_name(wav, t_start): entry_signature(wav, boxes) for (wav, t_start), boxes in chunks.items()}
+    todo = [(wav, t_start, boxes) for (wav, t_start), boxes in chunks.items()
+            if manifest.get(entry_name(wav, t_start)) != signatures[entry_name(wav, t_start)]]
+
+    removed = [name for name in manifest if name not in signatures]
+    for name in removed:
+        for path in (os.path.join(out_dir, "images", name + ".png"), os.path.join(out_dir, "labels", name + ".txt")):
+            if os.path.exists(path):
+                os.remove(path)
+        del manifest[name]
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(export_entry, wav, t_start, boxes, out_dir) for wav, t_start, boxes in todo]
+
+            for future in as_completed(futures):
+                name = future.result()
+                manifest[name] = signatures[name]
+    finally:
+        #Saved even if an entry fails, so the finished ones aren't rebuilt next time
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+
+    with open(os.path.join(out_dir, "classes.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(CLASSES) + "\n")
+
+    return len(todo), len(chunks) - len(todo), len(removed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export labelled chunks as a YOLO dataset")
+    parser.add_argument("--labels", default=LABEL_DB, help="label database saved by the labeller")
+    parser.add_argument("--import-csv", action="store_true", help="first move label CSVs from older labeller versions in LABELS into the database")
+    parser.add_argument("--out", default=YOLO_DATASET)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.import_csv:
+        label_db = LabelDatabase(args.labels)
+        print(f"Imported {label_db.import_csv(LABELS)} boxes")
+        label_db.close()
+
+    rebuilt, unchanged, removed = export_dataset(read_labels(args.labels), args.out, args.workers)
+    print(f"{rebuilt} rebuilt, {unchanged} unchanged, {removed} removed")
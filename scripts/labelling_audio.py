@@ -1,10 +1,10 @@
 import os
 
 import numpy as np
-import pandas as pd
 
 import csv
-import glob
+import threading
+from collections import OrderedDict, namedtuple
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
@@ -12,42 +12,189 @@ from ttkwidgets import Table
 
 import matplotlib
 matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.patches import Rectangle
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.widgets import RectangleSelector
 
-import librosa
-import librosa.display
-import soundfile as sf
-
-import sounddevice as sd
-
+#librosa, soundfile, sounddevice and src.AudioLoader (scipy) are slow to import, so they're imported where they're
+#first used to get the window up quicker
 
 #from src import WavController
-from src.config import SPECTROGRAMS, FULL_WAV, WAV_CHUNKS, LABELS, SPLIT_CSV, LABELS, SPECTROGRAMS
-
+from src.config import FULL_WAV, SPLIT_CSV
+from src.config import TARGET_SAMPLE_RATE, CHUNK_SECONDS, N_FFT, HOP, N_MELS, MIN_FREQ, CHUNK_HOP, STFT_PAD, CLASSES, DEFAULT_CLASS
+from src.DetectionIndex import DetectionIndex
+from src.LabelDatabase import LabelDatabase
+from src.Detections import recording_start, recording_name, detection_span
+from src.MelFrontend import get_frontend, power_to_db
+from src.SpectrogramStore import SpectrogramStore, known_file_hash
+
+
+# Config constants (spectrogram settings and classes are in src.config):
+#Prev/Next move by a whole chunk, spectrograms this many steps either side are computed in the background
+NAV_STEP = CHUNK_SECONDS
+PREFETCH_CHUNKS = 4
+#Each zoom step doubles or halves the seconds in view, panning moves by PAN_FRACTION of the view
+ZOOM_FACTOR = 2
+PAN_FRACTION = 0.5
+
+
+#What a recording's chunk spectrograms are computed from, taken when the wav is loaded so the prefetch thread never
+#mixes one file's audio with another file's settings
+ChunkSource = namedtuple("ChunkSource", ["wav_path", "sample_rate", "duration", "audio"])
+
+
+def ensure_dir(path):
+    """Creates path the first time it's needed instead of at startup, returns it."""
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class SpecPrefetcher():
+    """
+    Computes the spectrograms of the chunks either side of the current one on a background thread, so stepping
+    through a recording doesn't have to wait for them. Requests left over from an old position are dropped when the
+    user moves somewhere else, and results are only kept for the key (file and spectrogram settings) they were asked for.
+    """
+
+    def __init__(self, compute, radius=PREFETCH_CHUNKS, step=NAV_STEP):
+        #compute(source, t_start) -> spectrogram, called on the worker thread
+        self.compute = compute
+        self.radius = radius
+        self.step = step
+
+        self.cache = OrderedDict()
+        self.max_cached = 4*radius + 2
+        self.pending = []
+        self.key = None
+        self.source = None
+        self.centre = 0.0
+
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def get(self, key, t_start):
+        with self.condition:
+            spec = self.cache.get((key, round(t_start, 3)))
+            if spec is not None:
+                self.cache.move_to_end((key, round(t_start, 3)))
+            return spec
+
+    def around(self, key, source, t_start, t_max):
+        """
+        Replaces any outstanding requests with the chunks around t_start, nearest first.
+        source is what compute is given, key is what it's cached under. A new key drops everything for the old one.
+        """
+        with self.condition:
+            if key != self.key:
+                self.cache.clear()
+            self.key = key
+            self.source = source
+            self.centre = t_start
+
+            self.pending = []
+            for i in range(1, self.radius+1):
+                for t in (t_start + i*self.step, t_start - i*self.step):
+                    t = round(min(max(0.0, t), t_max), 3)
+                    if (key, t) not in self.cache and t not in self.pending:
+                        self.pending.append(t)
+
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key, source, t_start = self.key, self.source, self.pending.pop(0)
 
-#TODO:
-#1) add export
-
-# Config constants:
-CHUNK_SECONDS = 3.0
-N_FFT = 512
-HOP = N_FFT//4
-N_MELS = 64
-MIN_FREQ = 150
-MAX_FREQ = 15000
-
-CLASSES = ["Eurasian_Skylark", "Yellowhammer", "European Goldfinch", 
-        "Eurasian Linnet", "European Robin", "Spotted Flycatcher", "Dunnock", 
-        "Eurasian Magpie", "Unknown Bird"]
-DEFAULT_CLASS = CLASSES[-1]
+            try:
+                spec = self.compute(source, t_start)
+            except Exception:
+                continue
+
+            with self.condition:
+                #Discard results for a file or position the user has since moved away from
+                if key != self.key or abs(t_start - self.centre) > self.radius*self.step:
+                    continue
+
+                self.cache[(key, t_start)] = spec
+                while len(self.cache) > self.max_cached:
+                    self.cache.popitem(last=False)
+
+
+class VirtualTable(ttk.Frame):
+    """
+    Table that only has tree items for the rows in view. All rows are kept in a list and swapped into the same few
+    items as it scrolls, so loading a huge BirdNET export doesn't insert thousands of items.
+    """
+
+    def __init__(self, master, columns, row_height=20):
+        super().__init__(master)
+        self.rows = []
+        self.top = 0
+        self.visible = 1
+        self.row_height = row_height
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", selectmode="browse")
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        self.tree.bind("<Button-4>", lambda _: self.scroll(-1))
+        self.tree.bind("<Button-5>", lambda _: self.scroll(1))
+
+    def heading(self, col, **kwargs):
+        self.tree.heading(col, **kwargs)
+
+    def column(self, col, **kwargs):
+        self.tree.column(col, **kwargs)
+
+    def set_rows(self, rows):
+        self.rows = rows
+        self.top = 0
+        self._render()
+
+    def scroll(self, n):
+        self.top = max(0, min(self.top + n, len(self.rows) - self.visible))
+        self._render()
+
+    def yview(self, *args):
+        """Scrollbar callback, ("moveto", fraction) or ("scroll", n, "units"/"pages")."""
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.rows))
+            self.scroll(0)
+        elif args[0] == "scroll":
+            n = int(args[1])
+            self.scroll(n * self.visible if args[2] == "pages" else n)
+
+    def _on_resize(self, event):
+        #Headings take roughly one row
+        visible = max(1, event.height//self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.scroll(0)
+
+    def _render(self):
+        rows = self.rows[self.top:self.top+self.visible]
+        items = self.tree.get_children()
+
+        for item, row in zip(items, rows):
+            self.tree.item(item, values=row)
+        for row in rows[len(items):]:
+            self.tree.insert("", "end", values=row)
+        for item in items[len(rows):]:
+            self.tree.delete(item)
+
+        if self.rows:
+            self.scrollbar.set(self.top/len(self.rows), min(1.0, (self.top + self.visible)/len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
 
-os.makedirs(LABELS, exist_ok=True)
-os.makedirs(SPECTROGRAMS, exist_ok=True)
-os.makedirs(FULL_WAV, exist_ok=True)
-os.makedirs(WAV_CHUNKS, exist_ok=True)
 
 #Rectangle Select requires parameters (eclick, erelease), cannot be used as method inside class
 def on_select_box(eclick, erelease):
@@ -62,11 +209,25 @@ class SpectrogramLabeller(tk.Tk):
         #State vars
         self.wav_path = None
         self.csv_path = None
+        #BirdNET rows from csv_path, and an index of their times in the recording if they could be worked out
+        self.csv_rows = []
+        self.csv_index = None
         self.sample_rate = None
         self.audio = None
         self.t_start = 0.0
         self.audio_chunk = None
         self.duration = None
+        #Snapshot of the loaded recording for computing its chunks, see ChunkSource
+        self.source = None
+        #Seconds shown, CHUNK_SECONDS is the normal chunk view and anything more is drawn from the recording's TilePyramid
+        self.view_seconds = CHUNK_SECONDS
+        self.view_t0 = 0.0
+        self.pyramid = None
+
+        self.spec_store = SpectrogramStore()
+        #Opened on the first export, see label_db
+        self._label_db = None
+        self.prefetcher = SpecPrefetcher(self._prefetch_spec)
 
         self.current_class = DEFAULT_CLASS
         self.labels = []
@@ -76,11 +237,20 @@ class SpectrogramLabeller(tk.Tk):
         self._build_ui_()
 
         # --- Put matplotlib figure in tk ---
-        self.fig, self.ax = plt.subplots(1,1,figsize=(7.5,4.5))
+        #Figure rather than pyplot, the figure lives in the tk window so pyplot's window management isn't needed
+        self.fig = Figure(figsize=(7.5,4.5))
+        self.ax = self.fig.add_subplot(1,1,1)
         self.color_bar = None
+        self.img = None
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.spec_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
+        #Figure without the boxes, saved after every full draw so boxes can be blitted over it
+        #Connected before the selector so its own background is saved with the boxes already drawn
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.canvas.mpl_connect("scroll_event", self.on_scroll)
+
         # --- Rectangle selector for labelling ---
         self.boundary_selector = RectangleSelector(
             self.ax,
@@ -92,7 +262,7 @@ class SpectrogramLabeller(tk.Tk):
             drag_from_anywhere=True
         )
 
-        self.keybinds={"deselect":"Escape"}
+        self.keybinds={"deselect":"Escape", "prev":"Left", "next":"Right", "zoom_in":"equal", "zoom_out":"minus"}
         self.bind("<Key>", self.on_key_press)
 
         self._refresh_status()
@@ -116,6 +286,10 @@ class SpectrogramLabeller(tk.Tk):
         start_entry = ttk.Entry(top_panel, textvariable=self.start_var, width=10)
         start_entry.pack(side=tk.LEFT)
         ttk.Button(top_panel, text="Load chunk", command=self.load_chunk_from_entry).pack(side=tk.LEFT, padx=6)
+        ttk.Button(top_panel, text="< Prev", command=self.prev_chunk).pack(side=tk.LEFT, padx=(6,2))
+        ttk.Button(top_panel, text="Next >", command=self.next_chunk).pack(side=tk.LEFT, padx=2)
+        ttk.Button(top_panel, text="Zoom out", command=lambda: self.zoom(ZOOM_FACTOR)).pack(side=tk.LEFT, padx=(6,2))
+        ttk.Button(top_panel, text="Zoom in", command=lambda: self.zoom(1/ZOOM_FACTOR)).pack(side=tk.LEFT, padx=2)
 
         ttk.Button(top_panel, text="Play chunk", command=self.play_chunk).pack(side=tk.LEFT, padx=(16,4))
         ttk.Button(top_panel, text="Stop", command=self.stop_playback).pack(side=tk.LEFT, padx=4)
@@ -134,6 +308,10 @@ class SpectrogramLabeller(tk.Tk):
         ttk.Button(class_frame, text="Delete last box", command=self.delete_last_box).pack(side=tk.LEFT, padx=10)
         ttk.Button(class_frame, text="Clear boxes", command=self.clear_boxes).pack(side=tk.LEFT)
 
+        #Off by default, only the window being shown is read from the file
+        self.full_decode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(class_frame, text="Decode whole file", variable=self.full_decode_var).pack(side=tk.LEFT, padx=(16,0))
+
         
         # ------ Main frame: spectrogram + labels || CSV table ------
         main = ttk.PanedWindow(self, orient=tk.HORIZONTAL)
@@ -170,7 +348,12 @@ class SpectrogramLabeller(tk.Tk):
 
         cols = ("Start (s)", "End (s)", "Location", "SciName", "CommonName", "Confidence")
         ttk.Label(self.table_frame, text="BirdNet Labels").pack(side=tk.TOP, anchor="w")
-        self.label_table = Table(self.table_frame, columns=cols, sortable=False, drag_cols=False, drag_rows=False)
+
+        #Only show the detections overlapping the chunk on screen, updated as the chunk changes
+        self.window_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.table_frame, text="Current chunk only", variable=self.window_only_var, command=self.refresh_csv_table).pack(side=tk.TOP, anchor="w")
+
+        self.label_table = VirtualTable(self.table_frame, columns=cols)
 
 
         for col in cols:
@@ -190,13 +373,27 @@ class SpectrogramLabeller(tk.Tk):
 
         wav = os.path.basename(self.wav_path) if self.wav_path else "(none)"
         csv = os.path.basename(self.csv_path) if self.csv_path else "(none)"
-        self.status_label.set(f"Wav: {wav} | CSV: {csv} | Start: {self.t_start:.3f}s | Chunk: {CHUNK_SECONDS:.1f}s | Class: {self.current_class}")
+        view = f"View: {self.view_t0:.1f}s +{self.view_seconds:.0f}s" if self.zoomed_out() else f"Start: {self.t_start:.3f}s | Chunk: {CHUNK_SECONDS:.1f}s"
+        self.status_label.set(f"Wav: {wav} | CSV: {csv} | {view} | Class: {self.current_class}")
 
     def on_key_press(self, event):
         if event.keysym == self.keybinds["deselect"]:
             toggle = True if self.boundary_selector.get_active else False
             self.boundary_selector.set_active(toggle)
 
+        #Arrow keys move the cursor while typing a start time
+        if isinstance(event.widget, (tk.Entry, ttk.Entry)):
+            return
+
+        if event.keysym == self.keybinds["prev"]:
+            self.prev_chunk()
+        elif event.keysym == self.keybinds["next"]:
+            self.next_chunk()
+        elif event.keysym == self.keybinds["zoom_in"]:
+            self.zoom(1/ZOOM_FACTOR)
+        elif event.keysym == self.keybinds["zoom_out"]:
+            self.zoom(ZOOM_FACTOR)
+
         
     
 
@@ -208,7 +405,7 @@ class SpectrogramLabeller(tk.Tk):
         path = filedialog.askopenfilename(
             title="Select .wav",
             filetypes=[("WAV Files", "*.wav"), ("All Files", "*.*")],
-            initialdir=FULL_WAV
+            initialdir=ensure_dir(FULL_WAV)
         )    
         if not path:
             return
@@ -236,17 +433,32 @@ class SpectrogramLabeller(tk.Tk):
     # ---------- Load wav + chunks ----------
 
     def load_wav(self):
-        """Loads audio from the contained wav_path, requires wav_path to be defined."""
+        """
+        Opens the wav at wav_path, requires wav_path to be defined.
+        Unless "Decode whole file" is ticked only the header is read here, chunks are read from the file as they're shown.
+        """
 
 
         try:
-            audio, sample_rate = librosa.load(self.wav_path, mono=True, dtype=float)
+            if self.full_decode_var.get():
+                from src.AudioLoader import load_audio
+                audio, sample_rate = load_audio(self.wav_path)
+                duration = len(audio)/sample_rate
+            else:
+                import soundfile as sf
+                info = sf.info(self.wav_path)
+                audio = None
+                sample_rate = info.samplerate if TARGET_SAMPLE_RATE is None else TARGET_SAMPLE_RATE
+                duration = info.frames/info.samplerate
         except Exception as e:
             messagebox.showerror("Load wav failed.", str(e))
+            return
 
         self.audio = audio
         self.sample_rate = sample_rate
-        self.duration = len(audio)/sample_rate
+        self.duration = duration
+        self.source = ChunkSource(self.wav_path, sample_rate, duration, audio)
+        self.pyramid = None
         self.t_start=0.0
         self.start_var.set("0.0")
 
@@ -256,7 +468,7 @@ class SpectrogramLabeller(tk.Tk):
         """Loads an audio chunk from the full audio file, requires a wav file to be loaded."""
 
 
-        if self.audio is None:
+        if self.duration is None:
             messagebox.showwarning("No wav!", "Select wav first")
             return
 
@@ -267,43 +479,152 @@ class SpectrogramLabeller(tk.Tk):
             return
         self.load_chunk(t)
 
+    def prev_chunk(self):
+        if self.duration is None:
+            return
+        if self.zoomed_out():
+            self.show_view(self.view_t0 - PAN_FRACTION*self.view_seconds)
+        else:
+            self.load_chunk(self.t_start - NAV_STEP)
+
+    def next_chunk(self):
+        if self.duration is None:
+            return
+        if self.zoomed_out():
+            self.show_view(self.view_t0 + PAN_FRACTION*self.view_seconds)
+        else:
+            self.load_chunk(self.t_start + NAV_STEP)
+
     def load_chunk(self, t_start: float):
         
 
         t_start = max(0.0, min(t_start,max(0.0, self.duration - CHUNK_SECONDS)))
         self.t_start = t_start
 
-        i0 = int(round(t_start*self.sample_rate))
-        i1 = int(round(t_start+CHUNK_SECONDS)*self.sample_rate)
+        #Back to the chunk view, where boxes can be drawn
+        self.view_seconds = CHUNK_SECONDS
+        self.view_t0 = t_start
+        self.boundary_selector.set_active(True)
+        self.start_var.set(f"{t_start:.3f}")
 
-        self.audio_chunk = self.audio[i0:i1].copy()
+        padded_chunk = self._chunk_audio(t_start)
+        self.audio_chunk = padded_chunk[STFT_PAD:-STFT_PAD]
 
         self.clear_boxes()
 
-        self.draw_spectrogram()
+        #Use the background thread's spectrogram if it's already been computed for this file and these settings
+        spec_key = self.spec_key(self.source)
+        spec_db = self.prefetcher.get(spec_key, t_start)
+        if spec_db is None:
+            #The store is keyed by a hash of the whole file, the prefetch thread works that out so it doesn't hold up
+            #the first spectrogram of a new file, until then chunks are computed straight from the audio
+            spec_db = self.compute_spec(t_start, padded_chunk, use_store=known_file_hash(self.source.wav_path) is not None)
+
+        self.draw_spectrogram(spec_db)
+
+        if self.window_only_var.get():
+            self.refresh_csv_table()
 
         self._refresh_status()
 
+        self.prefetcher.around(spec_key, self.source, t_start, max(0.0, self.duration - CHUNK_SECONDS))
+
+    def _chunk_audio(self, t_start, source=None):
+        """Chunk starting at t_start with STFT_PAD samples of the surrounding audio either side."""
+        source = source or self.source
+        if source.audio is None:
+            from src.AudioLoader import read_window
+            return read_window(source.wav_path, t_start, t_start+CHUNK_SECONDS, sr=source.sample_rate, pad=STFT_PAD)[0]
+
+        i0 = int(round(t_start*source.sample_rate)) - STFT_PAD
+        i1 = int(round((t_start+CHUNK_SECONDS)*source.sample_rate)) + STFT_PAD
+
+        #Zeros past either end of the recording, same as read_window
+        chunk = np.zeros(i1 - i0, dtype=np.float32)
+        r0, r1 = max(0, i0), min(len(source.audio), i1)
+        chunk[r0-i0:r1-i0] = source.audio[r0:r1]
+
+        return chunk
+
+    def _prefetch_spec(self, source, t_start):
+        #Runs on the prefetch thread, only reads the snapshot it's given so switching files part way can't mix them up
+        return self.compute_spec(t_start, self._chunk_audio(t_start, source), source=source)
+
     # ---------- Spectrogram + labelling ----------
 
-    def compute_spec(self):
-        mel_spec = librosa.feature.melspectrogram(
-            y=self.audio_chunk,
-            sr=self.sample_rate,
-            n_fft=N_FFT,
-            n_mels=N_MELS,
-            hop_length=HOP,
-            fmin = MIN_FREQ,
+    def spec_key(self, source):
+        """What a chunk's spectrogram depends on besides its start time, prefetched spectrograms are only used for the same key."""
+        return source.wav_path, tuple(sorted(self.spec_params(source.sample_rate).items()))
+
+    def spec_params(self, sample_rate=None):
+        sample_rate = sample_rate or self.sample_rate
+        return {
+            "mode": "labeller_padded",
+            "sample_rate": sample_rate,
+            "chunk_length": CHUNK_SECONDS,
+            "n_fft": N_FFT,
+            "n_mels": N_MELS,
+            "hop_length": HOP,
+            "min_freq": MIN_FREQ,
             #Removes black box from top of spectrogram, sample rate of AudioMoth not high enough for 150khz
-            fmax = min(self.sample_rate/2, 150000) 
+            "max_freq": min(sample_rate/2, 150000),
+        }
+
+    def compute_spec(self, t_start, audio_chunk, use_store=True, source=None):
+        """
+        dB mel spectrogram of the chunk starting at t_start, safe to call from the prefetch thread.
+        audio_chunk includes STFT_PAD samples either side, as returned by _chunk_audio from the same source.
+        use_store=False skips the spectrogram store, which hashes the whole file the first time it's used.
+        """
+        source = source or self.source
+        params = self.spec_params(source.sample_rate)
+
+        #Chunks on the hop grid are looked up in the spectrogram store before being computed
+        index = t_start/CHUNK_HOP
+        n_chunks = int((source.duration - CHUNK_SECONDS)//CHUNK_HOP) + 1
+        cacheable = use_store and index == int(index) and int(index) < n_chunks
+
+        if cacheable:
+            mel_spec = self.spec_store.get_chunk(source.wav_path, params, int(index))
+            if mel_spec is not None:
+                return power_to_db(mel_spec)
+
+        frontend = get_frontend(
+            params["sample_rate"],
+            params["n_fft"],
+            params["n_mels"],
+            params["min_freq"],
+            params["max_freq"],
+            params["hop_length"]
         )
-        return librosa.power_to_db(mel_spec, ref=np.max)
+        #Padding is already real audio, so frames aren't centred a second time
+        mel_spec = frontend(audio_chunk, center=False)
+
+        if cacheable:
+            self.spec_store.put_chunk(source.wav_path, params, int(index), mel_spec, n_chunks)
+
+        return power_to_db(mel_spec)
 
-    def draw_spectrogram(self):
+    def draw_spectrogram(self, spec_db):
+        """
+        The image and colorbar are only built for the first chunk (or when the sample rate changes the axes),
+        after that the image data and colour limits are swapped in place.
+        """
 
         if self.audio_chunk is None or self.sample_rate is None:
             return
 
+        if self.img is None or self.img.get_array().shape != spec_db.shape or self.img_sample_rate != self.sample_rate:
+            self._build_spectrogram(spec_db)
+        else:
+            self.img.set_array(spec_db)
+            self.img.set_clim(spec_db.min(), spec_db.max())
+
+        self.ax.set_title(f"{os.path.basename(self.wav_path)}: ({self.t_start:.2f})s -> ({self.t_start+CHUNK_SECONDS:.2f})s")
+
+        self.canvas.draw_idle()
+
+    def _remove_color_bar(self):
         if self.color_bar is not None:
             try:
                 self.color_bar.remove()
@@ -311,9 +632,11 @@ class SpectrogramLabeller(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Old colorbar couldn't be removed", str(e))
 
+    def _build_spectrogram(self, spec_db):
+        self._remove_color_bar()
         self.ax.clear()
-        spec_db = self.compute_spec()
 
+        import librosa.display
         self.img = librosa.display.specshow(
             spec_db,
             sr=self.sample_rate,
@@ -322,13 +645,38 @@ class SpectrogramLabeller(tk.Tk):
             y_axis="mel",
             ax=self.ax
         )
+        self.img_sample_rate = self.sample_rate
 
-        self.ax.set_title(f"{os.path.basename(self.wav_path)}: ({self.t_start:.2f})s -> ({self.t_start+CHUNK_SECONDS:.2f})s")
         self.color_bar = self.fig.colorbar(self.img, ax=self.ax, format="%+2.0f dB")
 
         self.ax.set_xlim(0, CHUNK_SECONDS)
 
-        self.canvas.draw_idle()
+    def on_draw(self, _):
+        """Saves the freshly drawn figure as the background for blitting, then puts the boxes back on top."""
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        for rect, txt in self.boundaries:
+            self.ax.draw_artist(rect)
+            self.ax.draw_artist(txt)
+
+    def _blit_boxes(self):
+        """Redraws just the boxes over the saved background, instead of the whole figure."""
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self.background)
+        for rect, txt in self.boundaries:
+            self.ax.draw_artist(rect)
+            self.ax.draw_artist(txt)
+
+        #Selector restores its own background while dragging, it needs the current boxes in it too
+        self.boundary_selector.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self.boundary_selector.artists:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+
+        self.canvas.blit(self.fig.bbox)
 
     def draw_box(self, eclick, erelease):
         click_valid = eclick.xdata is not None and eclick.ydata is not None
@@ -386,7 +734,7 @@ class SpectrogramLabeller(tk.Tk):
 
 
         self._draw_boundary(boundary)
-        self.canvas.draw_idle()
+        self._blit_boxes()
 
         self.labels.append(label)
 
@@ -399,9 +747,10 @@ class SpectrogramLabeller(tk.Tk):
         h = boundary["height"]
         w = boundary["width"]
 
-        rect = Rectangle((x,y),w,h,fill=False,linewidth=2)
+        #Animated artists are left out of full draws, they're blitted over the background instead
+        rect = Rectangle((x,y),w,h,fill=False,linewidth=2,animated=True)
         self.ax.add_patch(rect)
-        txt = self.ax.text(x,y+h,boundary["label"],fontsize=10,va="bottom")
+        txt = self.ax.text(x,y+h,boundary["label"],fontsize=10,va="bottom",animated=True)
 
         self.boundaries.append((rect, txt))
 
@@ -410,22 +759,25 @@ class SpectrogramLabeller(tk.Tk):
             rect, txt = self.boundaries.pop()
             rect.remove()
             txt.remove()
+            self.labels.pop()
 
         self.boundary_table.delete(self.boundary_table.get_children()[-1])
 
-        self.canvas.draw_idle()
+        self._blit_boxes()
 
     def clear_boxes(self):
         for boundary in self.boundary_table.get_children():
             self.boundary_table.delete(boundary)
 
+        had_boxes = len(self.boundaries) > 0
         for rect, txt in self.boundaries:
             rect.remove()
             txt.remove()
         self.boundaries = []
+        self.labels = []
 
-        if hasattr(self,"canvas"):
-            self.canvas.draw_idle()
+        if had_boxes and hasattr(self,"canvas"):
+            self._blit_boxes()
 
     def on_class_change(self, _):
         self.current_class = self.class_var.get()
@@ -436,10 +788,11 @@ class SpectrogramLabeller(tk.Tk):
 
 
     def load_csv_table(self):
-        for item in self.label_table.get_children():
-            self.label_table.delete(item)
+        self.csv_rows = []
+        self.csv_index = None
 
         if not self.csv_path:
+            self.refresh_csv_table()
             return
 
         try:
@@ -449,12 +802,118 @@ class SpectrogramLabeller(tk.Tk):
 
                 info_line = ",".join(next(label_reader))
 
-                for i,bird in enumerate(label_reader):
-                    self.label_table.insert("","end",values=bird)
+                self.csv_rows = list(label_reader)
 
         except Exception as e:
             messagebox.showerror("Load csv failed", str(e))
 
+        #Split CSVs are named after their recording, which is needed to place detections within the chunk
+        try:
+            start_time = recording_start(self.csv_path)
+            self.csv_index = DetectionIndex()
+            self.csv_index.add_recording(recording_name(self.csv_path), [detection_span(bird, start_time) for bird in self.csv_rows])
+        except (ValueError, IndexError):
+            self.csv_index = None
+
+        self.refresh_csv_table()
+
+    def refresh_csv_table(self):
+        """Shows all the BirdNET rows, or only those overlapping the current chunk if "Current chunk only" is ticked."""
+        if not self.window_only_var.get() or self.csv_index is None:
+            self.label_table.set_rows(self.csv_rows)
+            return
+
+        overlapping = self.csv_index.query(recording_name(self.csv_path), self.t_start, self.t_start + CHUNK_SECONDS)
+
+        self.label_table.set_rows([self.csv_rows[i] for i in overlapping])
+
+
+    # ---------- Zoom + pan ----------
+
+    def zoomed_out(self):
+        return self.view_seconds > CHUNK_SECONDS
+
+    def on_scroll(self, event):
+        """Mouse wheel zooms around the time under the cursor."""
+        if event.xdata is None or self.duration is None:
+            return
+
+        #The chunk view's x axis starts at 0, the zoomed out view's is the time in the recording
+        centre = event.xdata if self.zoomed_out() else self.t_start + event.xdata
+        self.zoom(1/ZOOM_FACTOR if event.button == "up" else ZOOM_FACTOR, centre)
+
+    def zoom(self, factor, centre=None):
+        """
+        Multiplies the seconds in view by factor around centre (the middle of the view by default).
+        Zooming in to CHUNK_SECONDS goes back to the normal chunk view, where boxes can be drawn.
+        """
+        if self.duration is None:
+            return
+
+        if centre is None:
+            centre = self.view_t0 + self.view_seconds/2
+
+        seconds = min(self.view_seconds*factor, max(CHUNK_SECONDS, self.duration))
+        if seconds <= CHUNK_SECONDS:
+            self.load_chunk(centre - CHUNK_SECONDS/2)
+            return
+
+        self.view_seconds = seconds
+        self.show_view(centre - seconds/2)
+
+    def show_view(self, t0):
+        """Draws view_seconds from t0 out of the recording's pyramid, only the frames in view are read."""
+        pyramid = self._get_pyramid()
+        if pyramid is None:
+            return
+
+        self.view_t0 = max(0.0, min(t0, self.duration - self.view_seconds))
+        t1 = self.view_t0 + self.view_seconds
+
+        spectrogram, left, right = pyramid.view(self.view_t0, t1)
+        spec_db = power_to_db(spectrogram)
+
+        #Boxes belong to a chunk, they're only drawn in the chunk view
+        self.clear_boxes()
+        self.boundary_selector.set_active(False)
+
+        self._remove_color_bar()
+        self.ax.clear()
+        self.img = self.ax.imshow(spec_db, origin="lower", aspect="auto", cmap="magma",
+                                  extent=(left, right, 0, spec_db.shape[0]), interpolation="nearest")
+        #Makes draw_spectrogram rebuild the chunk view's axes when zooming back in
+        self.img_sample_rate = None
+
+        self.color_bar = self.fig.colorbar(self.img, ax=self.ax, format="%+2.0f dB")
+        self.ax.set_xlim(self.view_t0, t1)
+        self.ax.set_xlabel("Time (s)")
+        self.ax.set_ylabel("Mel band")
+        self.ax.set_title(f"{os.path.basename(self.wav_path)}: ({self.view_t0:.1f})s -> ({t1:.1f})s")
+
+        self.canvas.draw_idle()
+        self._refresh_status()
+
+    def _get_pyramid(self):
+        """The loaded recording's TilePyramid, built the first time the recording is zoomed out."""
+        if self.pyramid is not None:
+            return self.pyramid
+
+        from src.TilePyramid import TilePyramid
+
+        self.status_label.set(f"Building zoom levels for {os.path.basename(self.wav_path)}...")
+        self.config(cursor="watch")
+        self.update_idletasks()
+
+        try:
+            self.pyramid = TilePyramid.get(self.wav_path, TARGET_SAMPLE_RATE)
+        except Exception as e:
+            messagebox.showerror("Zoom levels couldn't be built", str(e))
+            self.view_seconds = CHUNK_SECONDS
+        finally:
+            self.config(cursor="")
+            self._refresh_status()
+
+        return self.pyramid
 
     # ---------- Playback ----------
 
@@ -464,6 +923,7 @@ class SpectrogramLabeller(tk.Tk):
             return
 
         try:
+            import sounddevice as sd
             sd.stop()
             sd.play(self.audio_chunk, self.sample_rate)
         except Exception as e:
@@ -471,12 +931,20 @@ class SpectrogramLabeller(tk.Tk):
 
     def stop_playback(self):
         try:
+            import sounddevice as sd
             sd.stop()
         except Exception as e:
             messagebox.showerror("Playback couldn't be stopped", str(e))
 
 
     # ---------- Export ----------
+    @property
+    def label_db(self):
+        #LabelDatabase creates LABELS and the database file, only done once something is saved
+        if self._label_db is None:
+            self._label_db = LabelDatabase()
+        return self._label_db
+
     def export_current_chunk(self):
         if self.audio_chunk is None or self.sample_rate is None or not self.wav_path:
             messagebox.showinfo("Nothing to export", "Load a wav first")
@@ -484,31 +952,13 @@ class SpectrogramLabeller(tk.Tk):
         
         if len(self.boundaries)<1:
             messagebox.showinfo("Nothing to export", "Label a feature first")
+            return
 
 
-        label_num = len(glob.glob(LABELS+"*.csv"))
-        file_path = LABELS + str(label_num) + ".csv"
-
-        print(file_path)
-
-        with file_path.open("w",newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerows(self.label)
-            for label in self.boundary_table.get_children():
-                print("CHange this")
-                # centre_x = (label[1]+label[2])/2
-                # centre_y = (label[3]+label[4])/2
-                # width = label[2]-label[1]
-                # height = label[4]-label[3]
-                # print(centre_x, centre_y, width, height)
-
-            
-
-            #writer.writerows(self.boundary_table.get_children())
-
+        #Saving the same chunk again replaces its boxes rather than adding a second copy
+        self.label_db.replace_chunk(self.wav_path, round(self.t_start, 3), self.labels)
 
-        
-        
+        print(f"Saved {len(self.labels)} boxes for {os.path.basename(self.wav_path)} at {self.t_start:.3f}s")
 
 
 
@@ -0,0 +1,157 @@
+import os
+#Each worker process gets one core, stops numpy's BLAS threads fighting each other
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import Instrumentation
+from src.config import SPECTROGRAMS, SPLIT_CSV, TARGET_SAMPLE_RATE
+from src.DetectionIndex import DetectionIndex
+from src.Detections import find_recordings, recording_name
+from src.SpectrogramStore import shard_state
+from src.WavController import WavController
+
+"""
+Chunks every recording in a directory and stores its mel spectrograms in SPECTROGRAMS, spread over a process pool.
+Finished recordings are written to a manifest so a run that's stopped part way resumes where it left off.
+
+    python -m scripts.preprocess_wav --source full_wav --workers 32
+    python -m scripts.preprocess_wav --detections     (only chunks overlapping a BirdNET detection in SPLIT_CSV)
+"""
+
+MANIFEST = SPECTROGRAMS + "manifest.jsonl"
+
+
+def file_signature(file_path):
+    #A recording is re-processed if it's been replaced since it was last done
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def read_manifest(manifest_path):
+    """Returns (file path) -> latest manifest entry, later lines take priority."""
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+
+    with open(manifest_path, encoding="utf-8") as manifest:
+        for line in manifest:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                #Last line can be cut off if the run was killed mid-write
+                continue
+            entries[entry["file"]] = entry
+
+    return entries
+
+
+def is_done(entry, file_path, mode="full"):
+    return (entry is not None and entry["status"] == "done" and entry.get("mode", "full") == mode
+            and entry["signature"] == file_signature(file_path) and is_stored(entry))
+
+
+def is_stored(entry):
+    """Whether the shard a done entry wrote is still in the store, the store may have evicted it since."""
+    if entry.get("n_chunks") == 0:
+        #Nothing to store, e.g. no detections in the recording
+        return True
+
+    state = shard_state(entry["shard"])
+    #Detection runs only ever fill in some of a shard's chunks
+    return state == "complete" or (state == "partial" and entry.get("mode", "full") == "detections")
+
+
+def append_manifest(manifest_path, entry):
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        manifest.write(json.dumps(entry) + "\n")
+        manifest.flush()
+        os.fsync(manifest.fileno())
+
+
+def process_recording(file_path, detections=False):
+    """
+    Worker: chunk + mel for one recording, written to the spectrogram store.
+    With detections=True only the chunks overlapping a detection in the recording's split CSV are read and stored.
+    """
+    if detections:
+        return process_detections(file_path)
+
+    #Each recording is only read once here, so it isn't copied into the decoded audio cache the labeller uses
+    wav_controller = WavController(file_path, cache=False)
+    spectrograms = wav_controller.create_spectrogram_batch(save=True)
+
+    return {
+        "n_chunks": len(spectrograms),
+        "shard": wav_controller.store.shard_path(file_path, wav_controller.spectrogram_params("batch")),
+    }
+
+
+def process_detections(file_path, csv_dir=SPLIT_CSV):
+    name = recording_name(file_path)
+    csv_path = os.path.join(csv_dir, name + ".csv")
+
+    index = DetectionIndex()
+    if os.path.exists(csv_path):
+        index.add_csv(csv_path)
+
+    #Streaming controller only reads the file header and the sparse read seeks to each detection,
+    #streaming is native rate only so resampled recordings are loaded whole instead (not cached, as above)
+    wav_controller = WavController(file_path, stream=TARGET_SAMPLE_RATE is None, cache=False)
+    indices, _ = wav_controller.create_sparse_spectrograms(index.spans(name), save=True)
+
+    return {
+        "n_chunks": len(indices),
+        "of_chunks": int(wav_controller.num_chunks()),
+        "shard": wav_controller.store.shard_path(file_path, wav_controller.spectrogram_params()),
+    }
+
+
+def run(recordings, workers, manifest_path=MANIFEST, detections=False):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+
+    manifest = read_manifest(manifest_path)
+    mode = "detections" if detections else "full"
+    todo = [file for file in recordings if not is_done(manifest.get(file), file, mode)]
+
+    print(f"{len(recordings)} recordings, {len(recordings) - len(todo)} already done, {len(todo)} to process")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_recording, file, detections): file for file in todo}
+
+        for i, future in enumerate(as_completed(futures), 1):
+            file = futures[future]
+            entry = {"file": file, "signature": file_signature(file), "mode": mode}
+
+            try:
+                entry.update(future.result())
+                entry["status"] = "done"
+            except Exception as e:
+                entry["status"] = "failed"
+                entry["error"] = str(e)
+                failed += 1
+
+            append_manifest(manifest_path, entry)
+            print(f"[{i}/{len(todo)}] {entry['status']}: {os.path.basename(file)}")
+
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store mel spectrograms for every recording in a directory")
+    parser.add_argument("--source", default="full_wav", help="full_wav, preprocessed, or a path to a directory of wav files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--detections", action="store_true", help="only chunks overlapping a detection in the recording's split CSV")
+    parser.add_argument("--instrument", default=None, help="append per-stage timings to this JSON-lines report")
+    args = parser.parse_args()
+
+    if args.instrument:
+        Instrumentation.enable(args.instrument)
+
+    failed = run(find_recordings(args.source), args.workers, detections=args.detections)
+
+    if failed:
+        print(f"{failed} recordings failed, re-run to retry them")
@@ -0,0 +1,44 @@
+import argparse
+
+from src import Instrumentation
+from src.config import INFERENCE_CSV, TARGET_SAMPLE_RATE
+from src.Detections import find_recordings
+from src.InferenceEngine import InferenceEngine
+
+"""
+Runs a trained classifier over every recording in a directory, writing a BirdNET style CSV of detections per recording
+that the labeller and DetectionIndex can read like the split CSVs.
+
+    python -m scripts.run_inference --model model.onnx --source full_wav --activation sigmoid --skip-silent
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify every chunk of every recording in a directory")
+    parser.add_argument("--model", required=True, help=".onnx or TorchScript .pt model")
+    parser.add_argument("--source", default="full_wav", help="full_wav, preprocessed, or a path to a directory of wav files")
+    parser.add_argument("--out", default=INFERENCE_CSV)
+    parser.add_argument("--batch", type=int, default=64, help="most chunks run through the model at once")
+    parser.add_argument("--wait", type=float, default=0.05, help="seconds to wait for a batch to fill")
+    parser.add_argument("--producers", type=int, default=None, help="decode + spectrogram threads")
+    parser.add_argument("--threads", type=int, default=None, help="threads the model runtime uses")
+    parser.add_argument("--min-confidence", type=float, default=0.1)
+    parser.add_argument("--activation", choices=["sigmoid", "softmax"], default=None, help="if the model outputs logits")
+    parser.add_argument("--skip-silent", action="store_true", help="don't classify chunks with no activity")
+    parser.add_argument("--location", default="", help="written in the Location column")
+    parser.add_argument("--sample-rate", type=int, default=TARGET_SAMPLE_RATE, help="rate the model was trained at, other recordings are resampled to it")
+    parser.add_argument("--instrument", default=None, help="append per-stage timings to this JSON-lines report")
+    args = parser.parse_args()
+
+    if args.instrument:
+        Instrumentation.enable(args.instrument)
+
+    engine = InferenceEngine(args.model, max_batch=args.batch, max_wait=args.wait, producers=args.producers,
+                             threads=args.threads, min_confidence=args.min_confidence, activation=args.activation,
+                             skip_silent=args.skip_silent, location=args.location, out_dir=args.out,
+                             sample_rate=args.sample_rate)
+
+    summary = engine.run(find_recordings(args.source))
+
+    print(f"{summary['recordings']} recordings ({summary['failed']} failed), {summary['chunks']} chunks, "
+          f"{summary['audio_seconds']/3600:.1f}h of audio in {summary['seconds']:.0f}s, {summary['realtime']:.0f}x real time")
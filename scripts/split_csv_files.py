@@ -1,14 +1,24 @@
 import csv
+import json
+import os
 import sys
+from collections import OrderedDict
 
 from pathlib import Path
 
-from src.config import CSV_DATA, FULL_CSV, SPLIT_CSV
+import numpy as np
+
+from src.Instrumentation import timed
+from src.config import CSV_DATA, FULL_CSV, SPLIT_CSV, CSV_START, CSV_END, CSV_LOCATION, CSV_SCI_NAME, CSV_COMMON_NAME, CSV_CONFIDENCE
 
 """"
 Reads compiled data from given CSV file and produces CSVs based on the wav recording files.
 """
 
+#Running call counts, see count_calls
+CALL_COUNTS = CSV_DATA + "call_counts.json"
+COUNT_KEYS = ("species", "recording", "hour", "location")
+
 
 def get_file_name(date, time):
         #wav name is formatted as yyyyMMdd_hhmmss
@@ -24,6 +34,7 @@ def get_file_name(date, time):
 
         return str(year+month+day+"_"+hour+formatted_minute+"00")
 
+@timed("read_csv", file_arg=0)
 def read_csv(file_path):
     csv_files = {}
     bird_count = {}
@@ -82,6 +93,7 @@ def merge(left, right):
 
     return result
 
+@timed("write_csv")
 def construct_csv(info_line, csv_files):
     out_path = Path(SPLIT_CSV)
     out_path.mkdir(parents=True, exist_ok=True)
@@ -101,14 +113,261 @@ def construct_csv(info_line, csv_files):
             writer.writerows(birds)
 
 
-def count_calls():
-    pass
+@timed("split_csv", file_arg=0)
+def split_csv_streaming(file_path, max_open=64):
+    """
+    Single pass version of read_csv + construct_csv, each row is written to its recording's CSV as soon as it's read
+    so memory doesn't grow with the size of the export. Output files are byte for byte the same as construct_csv's.
+
+    Parameters
+        max_open: most output files kept open at once, the least recently written is closed when another is needed
+
+    Returns
+        info_line, bird_count (as read_csv)
+    """
+    out_path = Path(SPLIT_CSV)
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    bird_count = {}
+    open_files = OrderedDict() #file name -> (file, csv writer), most recently written last
+    started = set()
+
+    with open(file_path, newline='', encoding="utf-8-sig") as compiled_csv:
+        bird_reader = csv.reader(compiled_csv)
+
+        info_line = ",".join(next(bird_reader))
+
+        try:
+            for bird in bird_reader:
+                date, time = bird[0].split(" ")
+                csv_file = get_file_name(date, time)
+
+                species = (bird[3],bird[4])
+                bird_count[species] = bird_count.get(species, 0) + 1
+
+                if csv_file in open_files:
+                    open_files.move_to_end(csv_file)
+                else:
+                    if len(open_files) >= max_open:
+                        _, (oldest, _) = open_files.popitem(last=False)
+                        oldest.close()
+
+                    #First time a file is seen it's started fresh with the header, after that it's appended to
+                    first = csv_file not in started
+                    f = (out_path / f"{csv_file}.csv").open("w" if first else "a", newline="", encoding="utf-8")
+                    writer = csv.writer(f)
+                    if first:
+                        writer.writerow(info_line.split(","))
+                        started.add(csv_file)
+                    open_files[csv_file] = (f, writer)
+
+                open_files[csv_file][1].writerow(bird)
+        finally:
+            for f, _ in open_files.values():
+                f.close()
+
+    return info_line, bird_count
+
+
+@timed("read_columnar", file_arg=0)
+def read_columnar(file_path):
+    """
+    Reads the CSV into typed columns instead of lists of strings:
+        timestamps, end_timestamps: datetime64[m]
+        species_codes, location_codes: int32 codes into the species ("sci,common") and locations arrays
+        confidence: float32
+        recording_codes: int32 codes into recordings, the yyyyMMdd_hhmmss 20 minute recording each row falls in
+
+    Returns
+        dict of numpy arrays, can be saved with save_columnar
+    """
+    starts, ends, species, locations, confidence = [], [], [], [], []
+
+    with open(file_path, newline='', encoding="utf-8-sig") as compiled_csv:
+        bird_reader = csv.reader(compiled_csv)
+        next(bird_reader)
+
+        for bird in bird_reader:
+            starts.append(bird[CSV_START])
+            ends.append(bird[CSV_END])
+            species.append(bird[CSV_SCI_NAME] + "," + bird[CSV_COMMON_NAME])
+            locations.append(bird[CSV_LOCATION])
+            confidence.append(bird[CSV_CONFIDENCE])
+
+    columns = {
+        "timestamps": parse_timestamps(starts),
+        "end_timestamps": parse_timestamps(ends),
+        "confidence": np.array(confidence, dtype=np.float32),
+    }
+    columns["species"], columns["species_codes"] = _categorical(species)
+    columns["locations"], columns["location_codes"] = _categorical(locations)
+    columns["recordings"], columns["recording_codes"] = recording_buckets(columns["timestamps"])
+
+    return columns
+
+
+def _categorical(values):
+    categories, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    return categories, codes.astype(np.int32)
+
+
+def parse_timestamps(values):
+    """
+    "dd/mm/yyyy hh:mm" strings -> datetime64[m]. A season only has so many distinct minutes,
+    so each distinct string is parsed once and the result is spread back out to every row.
+    Anything that isn't a date and time (e.g. seconds into a recording) becomes NaT.
+    """
+    unique, inverse = np.unique(np.array(values, dtype=str), return_inverse=True)
+
+    parsed = np.empty(len(unique), dtype="datetime64[m]")
+    for i, text in enumerate(unique):
+        try:
+            date, time = text.split(" ")
+            day, month, year = date.split("/")
+            hour, minute = time.split(":")[:2]
+            parsed[i] = np.datetime64(f"{int(year):04d}-{int(month):02d}-{int(day):02d}T{int(hour):02d}:{int(minute):02d}")
+        except ValueError:
+            parsed[i] = np.datetime64("NaT")
+
+    return parsed[inverse]
+
+
+def recording_buckets(timestamps):
+    """
+    Vectorised get_file_name: rounds every timestamp down to its 20 minute recording.
+
+    Returns
+        (recording names, int32 code of each row's recording), rows without a timestamp get code -1
+    """
+    valid = ~np.isnat(timestamps)
+    minutes = timestamps[valid].astype("datetime64[m]").astype(np.int64)
+    buckets = (minutes - minutes % 20).astype("datetime64[m]")
+
+    unique, valid_codes = np.unique(buckets, return_inverse=True)
+    codes = np.full(len(timestamps), -1, dtype=np.int32)
+    codes[valid] = valid_codes
+
+    #yyyy-mm-ddThh:mm -> yyyyMMdd_hhmm00
+    iso = np.datetime_as_string(unique, unit="m")
+    names = np.array([text[0:4] + text[5:7] + text[8:10] + "_" + text[11:13] + text[14:16] + "00" for text in iso], dtype=str)
+
+    return names, codes
+
+
+def count_species(columns):
+    """bird_count from read_csv, counted with one bincount over the species codes."""
+    counts = np.bincount(columns["species_codes"], minlength=len(columns["species"]))
+    return {tuple(name.split(",", 1)): int(count) for name, count in zip(columns["species"], counts) if count}
+
+
+def count_by_recording(columns):
+    """Rows per 20 minute recording."""
+    codes = columns["recording_codes"]
+    counts = np.bincount(codes[codes >= 0], minlength=len(columns["recordings"]))
+    return dict(zip(columns["recordings"].tolist(), counts.tolist()))
+
+
+def save_columnar(columns, out_path):
+    np.savez_compressed(out_path, **columns)
+
+
+def load_columnar(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+@timed("count_calls", file_arg=0)
+def count_calls(file_path, index_path=CALL_COUNTS):
+    """
+    Adds the rows of file_path to the call count index on disk, per species, recording, hour and location.
+    The byte offset read up to is saved for each CSV, so calling this again only reads rows appended since.
+
+    Returns
+        the updated index, as load_call_counts
+    """
+    index = load_call_counts(index_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    source = index["sources"].setdefault(os.path.abspath(file_path), {"offset": 0, "rows": 0})
+
+    if os.path.getsize(file_path) < source["offset"]:
+        raise ValueError(f"{file_path} is shorter than when it was last counted, delete {index_path} to recount")
+
+    with open(file_path, "rb") as compiled_csv:
+        compiled_csv.seek(source["offset"])
+        if source["offset"] == 0:
+            source["offset"] = len(compiled_csv.readline())
+
+        def complete_lines():
+            #A partly written last line is left for the next call
+            for line in compiled_csv:
+                if not line.endswith(b"\n"):
+                    return
+                source["offset"] += len(line)
+                yield line.decode("utf-8")
+
+        for bird in csv.reader(complete_lines()):
+            date, time = bird[CSV_START].split(" ")
+            keys = {
+                "species": bird[CSV_SCI_NAME] + "," + bird[CSV_COMMON_NAME],
+                "recording": get_file_name(date, time),
+                "hour": date + " " + time.split(":")[0],
+                "location": bird[CSV_LOCATION],
+            }
+
+            for count, key in keys.items():
+                index[count][key] = index[count].get(key, 0) + 1
+            source["rows"] += 1
+
+    #Written to a temporary file first so a crash can't leave a half written index
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+    return index
+
+
+def load_call_counts(index_path=CALL_COUNTS):
+    if not os.path.exists(index_path):
+        return {"sources": {}, **{count: {} for count in COUNT_KEYS}}
+
+    with open(index_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def call_summary(by="species", top=None, index_path=CALL_COUNTS):
+    """Counts from the index, largest first, without reading any CSVs. by is one of COUNT_KEYS."""
+    counts = load_call_counts(index_path)[by]
+    return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:top]
 
 
 if __name__ == "__main__":
     filename = sys.argv[1]
     file_path = FULL_CSV+filename
     print ("file: ", file_path)
+
+    #--counts adds any new rows to the running call counts and prints the totals
+    if "--counts" in sys.argv[2:]:
+        count_calls(file_path)
+        for by in COUNT_KEYS:
+            print(by, call_summary(by, top=10))
+        sys.exit()
+
+    #--columnar saves the CSV as typed arrays in CSV_DATA, e.g. full.csv -> full.npz, for quick re-analysis
+    if "--columnar" in sys.argv[2:]:
+        columns = read_columnar(file_path)
+        save_columnar(columns, CSV_DATA + Path(filename).stem + ".npz")
+        for bird in sorted(count_species(columns).items(), key=lambda item: item[1], reverse=True):
+            print (bird)
+        sys.exit()
+
+    #--stream writes the split files in one pass without holding the whole CSV in memory
+    if "--stream" in sys.argv[2:]:
+        info_line, bird_count = split_csv_streaming(file_path)
+        for bird in sorted(bird_count.items(), key=lambda item: item[1], reverse=True):
+            print (bird)
+        sys.exit()
+
     csv_files, info_line, bird_count = read_csv(file_path)
 
     print (len(csv_files))
@@ -0,0 +1,164 @@
+import hashlib
+import os
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+
+from src.config import PCM_CACHE, PCM_CACHE_BYTES, TARGET_SAMPLE_RATE
+from src.Instrumentation import stage
+from src.SpectrogramStore import save_npy, touch
+
+#Native samples read past each edge of a window that's being resampled
+RESAMPLE_PAD = 1024
+
+"""
+Decodes recordings to mono float32 at a chosen sample rate. Decoded (and resampled) audio is kept in PCM_CACHE as .npy
+files that are memory-mapped on the next load, so decoding and resampling is only ever done once per file and rate.
+Like the SpectrogramStore the cache is kept under a byte budget, least recently used files are removed first.
+"""
+
+
+def load_audio(file_path, sr=TARGET_SAMPLE_RATE, cache=True, max_bytes=PCM_CACHE_BYTES):
+    """
+    Parameters
+        sr: sample rate to return the audio at, None keeps the file's native rate (no resampling)
+        cache: read from / write to the decoded audio cache
+        max_bytes: the cache is trimmed back to this size after a write, None for no limit
+
+    Returns
+        (mono float32 audio, sample rate), the audio is a read-only memmap when cached
+    """
+    native_sr = sf.info(file_path).samplerate
+    sample_rate = native_sr if sr is None else int(sr)
+
+    cache_path = pcm_cache_path(file_path, sample_rate)
+    if cache and os.path.exists(cache_path):
+        touch(cache_path)
+        return np.load(cache_path, mmap_mode="r"), sample_rate
+
+    with stage("decode", file_path) as timing:
+        audio = decode(file_path)
+        timing.add_bytes(audio.nbytes)
+
+    if sample_rate != native_sr:
+        with stage("resample", file_path, audio.nbytes):
+            audio = resample(audio, native_sr, sample_rate)
+
+    if not cache:
+        return audio, sample_rate
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with stage("disk_write", file_path, audio.nbytes):
+        save_npy(cache_path, audio)
+
+    evict_pcm_cache(max_bytes, keep=cache_path)
+
+    return np.load(cache_path, mmap_mode="r"), sample_rate
+
+
+def evict_pcm_cache(max_bytes=PCM_CACHE_BYTES, keep=None, root=PCM_CACHE):
+    """Removes the least recently used decoded files until the cache is under max_bytes."""
+    if max_bytes is None or not os.path.isdir(root):
+        return
+
+    files = [entry for entry in os.scandir(root) if entry.name.endswith(".npy") and not entry.name.endswith(".tmp.npy")]
+    stats = [(entry.path, entry.stat()) for entry in files]
+    total = sum(stat.st_size for _, stat in stats)
+
+    for path, stat in sorted(stats, key=lambda file: file[1].st_mtime):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+
+        try:
+            os.remove(path)
+        except OSError:
+            #Still memory-mapped by another process on Windows, it's tried again on the next eviction
+            continue
+        total -= stat.st_size
+
+
+def decode(file_path):
+    """Whole file as mono float32 at its native rate, channels averaged the same way as librosa's mono=True."""
+    audio = sf.read(file_path, dtype="float32", always_2d=True)[0]
+    return np.mean(audio, axis=1, dtype=np.float32)
+
+
+def resample(audio, orig_sr, target_sr):
+    """Polyphase resampling by the reduced up/down ratio of the two rates, e.g. 48000 -> 32000 is up 2, down 3."""
+    if orig_sr == target_sr:
+        return audio
+
+    #scipy.signal is slow to import and most loads don't resample
+    from scipy.signal import resample_poly
+
+    divisor = gcd(orig_sr, target_sr)
+    return resample_poly(audio, target_sr//divisor, orig_sr//divisor).astype(np.float32, copy=False)
+
+
+def pcm_cache_path(file_path, sample_rate):
+    #Keyed on the file's path, size and modification time so a replaced recording isn't served stale audio
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    return os.path.join(PCM_CACHE, f"{name}_{sample_rate}.npy")
+
+
+def read_window(file_path, t_start, t_end, sr=TARGET_SAMPLE_RATE, pad=0):
+    """
+    Reads only t_start -> t_end seconds of the file, seeking to it rather than decoding everything before it.
+
+    Parameters
+        sr: sample rate to return the audio at, None keeps the file's native rate
+        pad: samples (at the returned rate) of the surrounding audio to add either side, e.g. for STFT frame edges
+
+    Returns
+        (mono float32 audio, sample rate), anything before the start or past the end of the file is zeros
+    """
+    with stage("decode_window", file_path) as timing, sf.SoundFile(file_path) as wav:
+        native_sr = wav.samplerate
+        sample_rate = native_sr if sr is None else int(sr)
+
+        #Resampling needs some real audio past the window edges for its filter, that part is trimmed off after
+        filter_pad = 0 if sample_rate == native_sr else RESAMPLE_PAD
+        native_pad = int(np.ceil(pad*native_sr/sample_rate)) + filter_pad
+
+        i0 = int(round(t_start*native_sr)) - native_pad
+        i1 = int(round(t_end*native_sr)) + native_pad
+
+        #Resampled output sample k lands on native sample k*down/up, starting on a multiple of down keeps the window's
+        #samples on the same grid as resampling the whole file, otherwise they're shifted by a fraction of a sample
+        down = native_sr//gcd(native_sr, sample_rate)
+        i0 -= i0 % down
+        audio = np.zeros(i1 - i0, dtype=np.float32)
+
+        frames = wav.frames
+        r0, r1 = max(0, i0), min(frames, i1)
+        if r1 > r0:
+            wav.seek(r0)
+            block = wav.read(r1 - r0, dtype="float32", always_2d=True)
+            audio[r0-i0:r0-i0+len(block)] = np.mean(block, axis=1, dtype=np.float32)
+
+        timing.add_bytes(audio.nbytes)
+
+    if sample_rate == native_sr:
+        return audio, sample_rate
+
+    with stage("resample", file_path, audio.nbytes):
+        audio = resample(audio, native_sr, sample_rate)
+
+    #Trim back to the window (plus pad) at the new rate, i0 is a multiple of down so its position there is exact
+    first = int(round(t_start*sample_rate)) - pad
+    o0 = first - i0*sample_rate//native_sr
+    n = int(round(t_end*sample_rate)) - int(round(t_start*sample_rate)) + 2*pad
+    audio = audio[o0:o0+n]
+
+    #The filter rings into the zeros past either end of the file, they're put back to zeros like the native rate case
+    n_out = -(-frames*sample_rate//native_sr)
+    audio[:max(0, -first)] = 0.0
+    audio[max(0, n_out - first):] = 0.0
+
+    return audio, sample_rate
@@ -0,0 +1,140 @@
+import csv
+import glob
+import os
+
+import numpy as np
+
+from src.config import SPLIT_CSV
+from src.Detections import recording_start, recording_name, detection_span
+
+"""
+Index over the BirdNET detections in the split CSVs, for asking which detections overlap a stretch of a recording.
+Each recording's detections are kept as start/end arrays sorted by start time, so a query is a binary search
+rather than a scan over every row.
+"""
+
+
+class DetectionIndex():
+
+    def __init__(self):
+        #recording name (yyyyMMdd_hhmmss) -> arrays for that recording
+        self.recordings = {}
+
+    @classmethod
+    def from_directory(cls, directory=SPLIT_CSV, keep_rows=False):
+        """Index of every split CSV in directory, keep_rows holds on to the CSV rows for rows()."""
+        index = cls()
+        for csv_path in sorted(glob.glob(os.path.join(directory, "*.csv"))):
+            index.add_csv(csv_path, keep_rows)
+
+        return index
+
+    def add_csv(self, csv_path, keep_rows=False):
+        with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+            reader = csv.reader(csv_file)
+            next(reader)
+            rows = list(reader)
+
+        start_time = recording_start(csv_path)
+        spans = [detection_span(bird, start_time) for bird in rows]
+        self.add_recording(recording_name(csv_path), spans, rows if keep_rows else None)
+
+    def add_recording(self, name, spans, rows=None):
+        """spans is a list of (start, end) seconds, in CSV row order. Query results are indices into this order."""
+        spans = np.asarray(spans, dtype=np.float64).reshape(-1, 2)
+
+        order = np.argsort(spans[:, 0], kind="stable")
+        starts = spans[order, 0]
+        ends = spans[order, 1]
+
+        self.recordings[name] = {
+            "order": order,
+            "starts": starts,
+            "ends": ends,
+            #Every end time sorted on its own, used to count overlaps without looking at any rows
+            "sorted_ends": np.sort(ends),
+            #No detection starts further back than this before a window and still overlaps it
+            "max_length": float(np.max(ends - starts)) if len(starts) else 0.0,
+            "rows": rows,
+        }
+
+    def __contains__(self, name):
+        return name in self.recordings
+
+    def query(self, name, t0, t1):
+        """Row indices (in CSV order) of the detections in recording name overlapping [t0, t1)."""
+        if name not in self.recordings:
+            return np.empty(0, dtype=np.intp)
+
+        recording = self.recordings[name]
+        starts, ends = recording["starts"], recording["ends"]
+
+        lo = np.searchsorted(starts, t0 - recording["max_length"], side="right")
+        hi = np.searchsorted(starts, t1, side="left")
+
+        candidates = np.arange(lo, hi)
+        return np.sort(recording["order"][candidates[ends[lo:hi] > t0]])
+
+    def query_many(self, name, t0s, t1s):
+        """query for every (t0, t1) pair at once, e.g. all chunks of a file. Returns a list of index arrays."""
+        t0s = np.asarray(t0s, dtype=np.float64)
+        t1s = np.asarray(t1s, dtype=np.float64)
+
+        if name not in self.recordings:
+            return [np.empty(0, dtype=np.intp) for _ in t0s]
+
+        recording = self.recordings[name]
+        starts, ends, order = recording["starts"], recording["ends"], recording["order"]
+
+        los = np.searchsorted(starts, t0s - recording["max_length"], side="right")
+        his = np.searchsorted(starts, t1s, side="left")
+
+        return [np.sort(order[lo + np.flatnonzero(ends[lo:hi] > t0)]) for lo, hi, t0 in zip(los, his, t0s)]
+
+    def counts(self, name, t0s, t1s):
+        """
+        Number of detections overlapping each [t0, t1), without finding which ones they are.
+        Everything starting before t1 overlaps unless it ended by t0, so it's two binary searches per window.
+        """
+        t0s = np.asarray(t0s, dtype=np.float64)
+        t1s = np.asarray(t1s, dtype=np.float64)
+
+        if name not in self.recordings:
+            return np.zeros(t0s.shape, dtype=np.intp)
+
+        recording = self.recordings[name]
+        started = np.searchsorted(recording["starts"], t1s, side="left")
+        ended = np.searchsorted(recording["sorted_ends"], t0s, side="right")
+
+        return started - ended
+
+    def chunk_windows(self, duration, chunk_length=3, hop=1):
+        """(t0s, t1s) of the chunks WavController.make_chunks cuts from a recording of this many seconds."""
+        n_chunks = max(0, int((duration - chunk_length)//hop) + 1)
+        t0s = np.arange(n_chunks) * hop
+
+        return t0s, t0s + chunk_length
+
+    def chunks_with_detections(self, name, duration, chunk_length=3, hop=1):
+        """Indices of the chunks of a recording that overlap at least one detection."""
+        t0s, t1s = self.chunk_windows(duration, chunk_length, hop)
+        return np.flatnonzero(self.counts(name, t0s, t1s) > 0)
+
+    def spans(self, name):
+        """(start, end) of every detection in recording name, in CSV row order."""
+        if name not in self.recordings:
+            return np.empty((0, 2))
+
+        recording = self.recordings[name]
+        spans = np.empty((len(recording["order"]), 2))
+        spans[recording["order"], 0] = recording["starts"]
+        spans[recording["order"], 1] = recording["ends"]
+
+        return spans
+
+    def rows(self, name, indices):
+        rows = self.recordings[name]["rows"]
+        if rows is None:
+            raise ValueError("Index was built without keep_rows")
+
+        return [rows[i] for i in indices]
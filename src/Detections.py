@@ -0,0 +1,84 @@
+import os
+from datetime import datetime
+
+from src.config import CSV_START, CSV_END, FULL_WAV, PREPROCESSED
+
+"""
+Helpers for placing BirdNET detections in time within a 20 minute recording.
+Recordings (and split CSVs) are named yyyyMMdd_hhmmss after the time they start.
+"""
+
+#Detections timed to the minute are treated as covering that whole minute
+MINUTE = 60.0
+
+#Recording directories the scripts' --source option can name
+SOURCES = {"full_wav": FULL_WAV, "preprocessed": PREPROCESSED}
+
+
+def find_recordings(directory):
+    """Every wav file under directory, sorted. directory can also be one of the SOURCES names."""
+    directory = SOURCES.get(directory, directory)
+
+    recordings = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith(".wav"):
+                recordings.append(os.path.join(root, file))
+
+    return sorted(recordings)
+
+
+def recording_start(recording_name):
+    """Start time of a recording from its file name, e.g. 20240605_184000.csv or Weaveley_BIRD_HedgerowNorth_20240605_184000.WAV"""
+    stem = os.path.splitext(os.path.basename(recording_name))[0]
+    date, time = stem.split("_")[-2:]
+
+    return datetime.strptime(date + time, "%Y%m%d%H%M%S")
+
+
+def recording_name(file_path):
+    """yyyyMMdd_hhmmss part of a wav or csv file name, used to match recordings to their split CSV."""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return "_".join(stem.split("_")[-2:])
+
+
+def parse_time(text):
+    """
+    Returns (seconds, datetime) for a start/end column, one of the two is None.
+    Plain numbers are seconds into the recording, otherwise dd/mm/yyyy hh:mm[:ss].
+    """
+    text = text.strip()
+    try:
+        return float(text), None
+    except ValueError:
+        pass
+
+    date, time = text.split(" ")
+    day, month, year = date.split("/")
+    parts = time.split(":")
+    second = parts[2] if len(parts) > 2 else 0
+
+    return None, datetime(int(year), int(month), int(day), int(parts[0]), int(parts[1]), int(float(second)))
+
+
+def detection_span(row, start_time):
+    """
+    (t0, t1) seconds into the recording starting at start_time that a CSV row covers.
+    Times without seconds only say which minute the call was in, so the span covers that minute.
+    """
+    t0, start = parse_time(row[CSV_START])
+    if start is not None:
+        t0 = (start - start_time).total_seconds()
+
+    try:
+        t1, end = parse_time(row[CSV_END])
+        if end is not None:
+            t1 = (end - start_time).total_seconds()
+    except (ValueError, IndexError):
+        t1 = t0
+
+    if t1 <= t0:
+        #Minute resolution, or no end given
+        t1 = t0 + MINUTE
+
+    return t0, t1
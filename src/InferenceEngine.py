@@ -0,0 +1,361 @@
+import csv
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import soundfile as sf
+
+from src.config import INFERENCE_CSV, TARGET_SAMPLE_RATE, CLASSES, CLASS_SCI_NAMES
+from src.config import CSV_START, CSV_END, CSV_LOCATION, CSV_SCI_NAME, CSV_COMMON_NAME, CSV_CONFIDENCE
+from src.Detections import recording_start
+from src.Instrumentation import stage
+from src.MelFrontend import power_to_db
+from src.WavController import WavController
+
+"""
+Runs a classifier over every chunk of a set of recordings on the CPU and writes its detections as BirdNET style CSVs.
+
+Producer threads decode recordings with WavController (streamed at the native rate) and compute dB mel spectrograms
+a group of chunks at a time. The consumer gathers whatever spectrograms are ready into batches of up to max_batch
+and runs the model on them, so decoding and mel work carry on while the model runs. numpy's FFT/matmul and the model
+runtimes release the GIL, so threads are enough to keep every core busy.
+
+Models take float32 (batch, n_mels, frames) dB spectrograms, the same as WavController.create_spectrogram + power_to_db,
+and return (batch, len(CLASSES)) scores.
+"""
+
+#Chunks whose spectrograms are computed in one frontend call by a producer
+SPEC_GROUP = 32
+
+#Spectrograms waiting for the model, bounds memory when the producers are ahead
+QUEUE_CHUNKS = 1024
+
+#BirdNET column names, in the CSV_* column order
+OUTPUT_HEADER = {
+    CSV_START: "Start (s)",
+    CSV_END: "End (s)",
+    CSV_LOCATION: "Location",
+    CSV_SCI_NAME: "Scientific name",
+    CSV_COMMON_NAME: "Common name",
+    CSV_CONFIDENCE: "Confidence",
+}
+
+
+# ---------- Backends ----------
+
+class NumpyBackend():
+    """Any callable taking a (batch, n_mels, frames) array and returning (batch, n_classes) scores."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, batch):
+        return np.asarray(self.model(batch), dtype=np.float32)
+
+
+class OnnxBackend():
+
+    def __init__(self, model_path, threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        #(batch, 1, n_mels, frames) models get a channel axis added
+        self.add_channel = len(model_input.shape) == 4
+
+    def __call__(self, batch):
+        if self.add_channel:
+            batch = batch[:, None]
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class TorchScriptBackend():
+
+    def __init__(self, model_path, threads=None):
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.model = torch.jit.load(model_path, map_location="cpu").eval()
+
+    def __call__(self, batch):
+        with self.torch.inference_mode():
+            return self.model(self.torch.from_numpy(batch)).numpy()
+
+
+def load_backend(model, threads=None):
+    """Backend for a .onnx or TorchScript (.pt/.ts) file, or a callable. Runtimes are only imported when used."""
+    if callable(model):
+        return NumpyBackend(model)
+
+    extension = os.path.splitext(model)[1].lower()
+    if extension == ".onnx":
+        return OnnxBackend(model, threads)
+    if extension in (".pt", ".ts", ".torchscript"):
+        return TorchScriptBackend(model, threads)
+
+    raise ValueError(f"Unknown model type {extension}, expected .onnx or a TorchScript .pt/.ts")
+
+
+def activate(scores, activation):
+    if activation == "sigmoid":
+        return 1/(1 + np.exp(-scores))
+    if activation == "softmax":
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return scores/scores.sum(axis=1, keepdims=True)
+    return scores
+
+
+# ---------- Engine ----------
+
+class InferenceEngine():
+
+    def __init__(self, model, classes=CLASSES, max_batch=64, max_wait=0.05, producers=None, threads=None,
+                 min_confidence=0.1, activation=None, skip_silent=False, location="", out_dir=INFERENCE_CSV,
+                 sample_rate=TARGET_SAMPLE_RATE):
+        """
+        Parameters
+            model: .onnx / TorchScript path or a numpy callable, see load_backend
+            max_batch: most chunks given to the model at once
+            max_wait: seconds to wait for a batch to fill before running what's there
+            producers: decode + spectrogram threads, half the cores by default
+            threads: threads the model runtime uses
+            activation: "sigmoid" or "softmax" if the model outputs logits
+            skip_silent: leave out chunks WavController.detect_activity judges silent
+            location: written in the Location column
+            sample_rate: rate the model was trained at, recordings at other rates are resampled to it.
+                None runs every recording at its native rate, each rate is batched separately
+        """
+        self.backend = load_backend(model, threads)
+        self.classes = classes
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.producers = producers or max(1, (os.cpu_count() or 2)//2)
+        self.min_confidence = min_confidence
+        self.activation = activation
+        self.skip_silent = skip_silent
+        self.location = location
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+
+    def run(self, recordings):
+        """
+        Classifies every chunk of every recording, writing out_dir/<recording file name>.csv as each one finishes.
+
+        Returns
+            {"recordings", "failed", "chunks", "audio_seconds", "seconds", "realtime"}
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+
+        todo = queue.Queue()
+        for recording in recordings:
+            todo.put(recording)
+
+        ready = queue.Queue(maxsize=QUEUE_CHUNKS)
+        workers = [threading.Thread(target=self._produce, args=(todo, ready), daemon=True) for _ in range(self.producers)]
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+
+        summary = self._consume(ready, len(workers))
+        summary["seconds"] = time.perf_counter() - start
+        summary["realtime"] = summary["audio_seconds"]/summary["seconds"] if summary["seconds"] > 0 else 0.0
+
+        return summary
+
+    # ---------- Producers ----------
+
+    def _produce(self, todo, ready):
+        """
+        Puts ("chunk", recording, (t_start, spectrogram)) for every chunk of each recording,
+        then ("done", recording, (audio seconds, chunk seconds)).
+        Items from one recording arrive in order, so "done" comes after all of its chunks.
+        """
+        while True:
+            try:
+                recording = todo.get_nowait()
+            except queue.Empty:
+                ready.put(("exit", None, None))
+                return
+
+            try:
+                ready.put(("done", recording, self._produce_recording(recording, ready)))
+            except Exception as e:
+                ready.put(("failed", recording, e))
+
+    def _produce_recording(self, recording, ready):
+        #Streaming only reads the file a block at a time, it's native rate only so resampling loads the recording instead
+        stream = self.sample_rate is None or sf.info(recording).samplerate == self.sample_rate
+        wav_controller = WavController(recording, stream=stream, sample_rate=self.sample_rate)
+        hop_seconds = int(wav_controller.chunk_length*wav_controller.sample_rate)//3/wav_controller.sample_rate
+
+        active = wav_controller.detect_activity() if self.skip_silent else None
+
+        group, starts = [], []
+        for i, chunk in enumerate(wav_controller.make_chunks(overlap=True)):
+            if active is not None and not active[i]:
+                continue
+
+            group.append(chunk)
+            starts.append(i*hop_seconds)
+
+            if len(group) == SPEC_GROUP:
+                self._put_group(recording, wav_controller, group, starts, ready)
+                group, starts = [], []
+
+        if group:
+            self._put_group(recording, wav_controller, group, starts, ready)
+
+        return sf.info(recording).duration, wav_controller.chunk_length
+
+    def _put_group(self, recording, wav_controller, group, starts, ready):
+        spectrograms = power_to_db(wav_controller.create_spectrogram(np.stack(group)))
+        for t_start, spectrogram in zip(starts, spectrograms):
+            ready.put(("chunk", recording, (t_start, spectrogram)))
+
+    # ---------- Consumer ----------
+
+    def _consume(self, ready, n_producers):
+        summary = {"recordings": 0, "failed": 0, "chunks": 0, "audio_seconds": 0.0}
+        #recording -> list of (t_start, class, confidence)
+        results = {}
+        #recording -> error, for recordings whose batch the model failed on
+        broken = {}
+
+        #Spectrograms are only batched with others of the same shape (recordings at other sample rates are longer
+        #or shorter), shape -> preallocated batch, shape -> [(recording, t_start)], shape -> time it must be run by
+        batches, batch_items, deadlines = {}, {}, {}
+
+        def flush(shape):
+            items = batch_items.pop(shape, [])
+            deadlines.pop(shape, None)
+            error = self._run_batch(batches[shape], items, results)
+            if error is not None:
+                #Only the recordings in this batch are lost, not the run
+                for recording, _ in items:
+                    broken.setdefault(recording, error)
+            summary["chunks"] += len(items)
+
+        while n_producers:
+            #Once a batch has started it's run when full, or when max_wait passes without it filling
+            timeout = None if not deadlines else max(0.0, min(deadlines.values()) - time.perf_counter())
+            try:
+                kind, recording, value = ready.get(timeout=timeout)
+            except queue.Empty:
+                kind = None
+
+            #Checked after every get, a steady stream of one shape mustn't hold up the others
+            now = time.perf_counter()
+            for shape in [shape for shape, deadline in deadlines.items() if deadline <= now]:
+                flush(shape)
+
+            if kind is None:
+                continue
+
+            if kind == "chunk":
+                if recording in broken:
+                    continue
+
+                t_start, spectrogram = value
+                shape = spectrogram.shape
+                if shape not in batches:
+                    #Preallocated once per shape, spectrograms are copied straight into it rather than stacked for every batch
+                    batches[shape] = np.empty((self.max_batch,) + shape, dtype=np.float32)
+                if shape not in batch_items:
+                    batch_items[shape] = []
+                    deadlines[shape] = time.perf_counter() + self.max_wait
+
+                items = batch_items[shape]
+                batches[shape][len(items)] = spectrogram
+                items.append((recording, t_start))
+
+                if len(items) == self.max_batch:
+                    flush(shape)
+                continue
+
+            #Anything else ends a recording (or a producer), what's gathered is run first so the recording's rows are complete
+            for shape in list(batch_items):
+                flush(shape)
+
+            if kind == "done" and recording in broken:
+                kind, value = "failed", broken.pop(recording)
+
+            if kind == "exit":
+                n_producers -= 1
+            elif kind == "done":
+                audio_seconds, chunk_seconds = value
+                self._write_csv(recording, results.pop(recording, []), chunk_seconds)
+                summary["recordings"] += 1
+                summary["audio_seconds"] += audio_seconds
+            elif kind == "failed":
+                results.pop(recording, None)
+                broken.pop(recording, None)
+                summary["failed"] += 1
+                print(f"Failed {os.path.basename(recording)}: {value}")
+
+        return summary
+
+    def _run_batch(self, batch, batch_items, results):
+        """
+        Runs the model on the gathered chunks and adds their detections to results.
+        Returns the model's exception rather than raising it, so only this batch's recordings fail. Errors anywhere
+        else are bugs and are raised.
+        """
+        if not batch_items:
+            return None
+
+        with stage("inference", None, batch[:len(batch_items)].nbytes):
+            try:
+                scores = activate(self.backend(batch[:len(batch_items)]), self.activation)
+            except Exception as e:
+                return e
+
+        for (recording, t_start), chunk_scores in zip(batch_items, scores):
+            for class_index in np.flatnonzero(chunk_scores >= self.min_confidence):
+                results.setdefault(recording, []).append((t_start, self.classes[class_index], float(chunk_scores[class_index])))
+
+        return None
+
+    # ---------- Output ----------
+
+    def _write_csv(self, recording, rows, chunk_seconds):
+        """
+        out_dir/<recording file name>.csv, the full name so recordings from different sites that start at the same time
+        don't overwrite each other. Times are dd/mm/yyyy hh:mm:ss when the recording's start is in its name.
+        """
+        try:
+            start_time = recording_start(recording)
+        except ValueError:
+            start_time = None
+
+        path = os.path.join(self.out_dir, os.path.splitext(os.path.basename(recording))[0] + ".csv")
+
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow([OUTPUT_HEADER[column] for column in sorted(OUTPUT_HEADER)])
+
+            for t_start, label, confidence in sorted(rows, key=lambda row: (row[0], -row[2])):
+                row = [None]*len(OUTPUT_HEADER)
+                row[CSV_START] = _format_time(start_time, t_start)
+                row[CSV_END] = _format_time(start_time, t_start + chunk_seconds)
+                row[CSV_LOCATION] = self.location
+                row[CSV_SCI_NAME] = CLASS_SCI_NAMES.get(label, label)
+                row[CSV_COMMON_NAME] = label.replace("_", " ")
+                row[CSV_CONFIDENCE] = f"{confidence:.4f}"
+                writer.writerow(row)
+
+
+def _format_time(start_time, seconds):
+    if start_time is None:
+        return f"{seconds:.3f}"
+    return (start_time + timedelta(seconds=seconds)).strftime("%d/%m/%Y %H:%M:%S")
@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    #Not on Windows, psutil is used instead if it's installed
+    resource = None
+
+"""
+Opt-in timing for the pipeline stages (decode, resample, chunking, mel, dB, disk writes, CSV reading/writing).
+Each stage run appends one JSON line to the report: stage, file, wall and CPU seconds, bytes processed and the
+process's peak RSS so far. Switched on with enable(path) or by setting BIRD_INSTRUMENT=path, which worker
+processes inherit. When it's off a stage is a shared do-nothing context manager, so it costs close to nothing.
+
+    BIRD_INSTRUMENT=report.jsonl python -m scripts.preprocess_wav
+    python -m src.Instrumentation report.jsonl --by stage
+"""
+
+REPORT_ENV = "BIRD_INSTRUMENT"
+
+_report_path = os.environ.get(REPORT_ENV) or None
+_lock = threading.Lock()
+
+
+def enable(report_path):
+    """Starts recording to report_path (appended to), including from worker processes started after this."""
+    global _report_path
+    _report_path = os.path.abspath(report_path)
+    os.environ[REPORT_ENV] = _report_path
+
+
+def disable():
+    global _report_path
+    _report_path = None
+    os.environ.pop(REPORT_ENV, None)
+
+
+def enabled():
+    return _report_path is not None
+
+
+def peak_rss():
+    """Highest resident memory of this process so far in bytes, None if it can't be found."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #kB on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak*1024
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss)
+
+
+class _Stage():
+    """Times the with block and writes its record on exit, even if the block raises."""
+
+    __slots__ = ("name", "file", "nbytes", "wall", "cpu")
+
+    def __init__(self, name, file=None, nbytes=0):
+        self.name = name
+        self.file = file
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+        """For when the amount of data is only known inside the block, e.g. after decoding."""
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            "stage": self.name,
+            "file": None if self.file is None else str(self.file),
+            #process_time covers every thread in the process, not just this one
+            "wall": time.perf_counter() - self.wall,
+            "cpu": time.process_time() - self.cpu,
+            "bytes": int(self.nbytes),
+            "peak_rss": peak_rss(),
+            "pid": os.getpid(),
+            "time": time.time(),
+            "failed": exc_type is not None,
+        }
+        _write(record)
+        return False
+
+
+class _NullStage():
+
+    __slots__ = ()
+
+    def add_bytes(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_DISABLED = _NullStage()
+
+
+def stage(name, file=None, nbytes=0):
+    """
+    Context manager recording one run of a stage, e.g.
+
+        with stage("decode", file_path) as timing:
+            audio = decode(file_path)
+            timing.add_bytes(audio.nbytes)
+    """
+    if _report_path is None:
+        return _DISABLED
+    return _Stage(name, file, nbytes)
+
+
+def timed(name, file_arg=None):
+    """
+    Decorator version of stage. With file_arg set, that positional argument is the file being processed
+    and its size on disk is counted as the bytes processed.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _report_path is None:
+                return func(*args, **kwargs)
+
+            file, nbytes = None, 0
+            if file_arg is not None and len(args) > file_arg:
+                file = args[file_arg]
+                nbytes = os.path.getsize(file) if os.path.isfile(file) else 0
+
+            with _Stage(name, file, nbytes):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _write(record):
+    path = _report_path
+    if path is None:
+        return
+
+    line = json.dumps(record) + "\n"
+    #One append per record, short appends from different processes don't interleave
+    with _lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def read_report(report_path):
+    with open(report_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarise(records, by="stage"):
+    """
+    Totals per stage, per file, or per (stage, file) with by="both".
+
+    Returns
+        key -> {"runs", "wall", "cpu", "bytes", "peak_rss"}, sorted by total wall time
+    """
+    def key(record):
+        if by == "stage":
+            return record["stage"]
+        if by == "file":
+            return record["file"] or "-"
+        return f"{record['stage']} {record['file'] or '-'}"
+
+    totals = {}
+    for record in records:
+        total = totals.setdefault(key(record), {"runs": 0, "wall": 0.0, "cpu": 0.0, "bytes": 0, "peak_rss": 0})
+        total["runs"] += 1
+        total["wall"] += record["wall"]
+        total["cpu"] += record["cpu"]
+        total["bytes"] += record["bytes"]
+        total["peak_rss"] = max(total["peak_rss"], record["peak_rss"] or 0)
+
+    return dict(sorted(totals.items(), key=lambda item: -item[1]["wall"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise an instrumentation report")
+    parser.add_argument("report")
+    parser.add_argument("--by", choices=["stage", "file", "both"], default="stage")
+    parser.add_argument("--top", type=int, default=None, help="only show the slowest this many")
+    args = parser.parse_args()
+
+    totals = summarise(read_report(args.report), args.by)
+    overall = sum(total["wall"] for total in totals.values()) or 1.0
+
+    print(f"{'':40s} {'runs':>7s} {'wall s':>9s} {'cpu s':>9s} {'%wall':>6s} {'MB':>9s} {'MB/s':>8s} {'peak RSS MB':>12s}")
+    for name, total in list(totals.items())[:args.top]:
+        mb = total["bytes"]/1024**2
+        rate = mb/total["wall"] if total["wall"] > 0 else 0.0
+        print(f"{name[-40:]:40s} {total['runs']:7d} {total['wall']:9.2f} {total['cpu']:9.2f} "
+              f"{100*total['wall']/overall:6.1f} {mb:9.1f} {rate:8.1f} {total['peak_rss']/1024**2:12.1f}")
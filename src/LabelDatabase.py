@@ -0,0 +1,163 @@
+import csv
+import glob
+import os
+import sqlite3
+from datetime import timedelta
+
+from src.config import LABELS, LABEL_DB, CHUNK_SECONDS, LABEL_COLUMNS
+from src.Detections import recording_start, recording_name
+
+"""
+Box labels from the labeller, kept in one SQLite file instead of a CSV per chunk.
+Indexed by recording + time and by class + date so queries like "all Yellowhammer boxes in June" don't scan everything.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY,
+    wav TEXT NOT NULL,
+    recording TEXT NOT NULL,
+    recorded_at TEXT,
+    t_start REAL NOT NULL,
+    t_end REAL NOT NULL,
+    label TEXT NOT NULL,
+    cx REAL NOT NULL,
+    cy REAL NOT NULL,
+    w REAL NOT NULL,
+    h REAL NOT NULL,
+    created TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS boxes_recording ON boxes (recording, t_start);
+CREATE INDEX IF NOT EXISTS boxes_label ON boxes (label, recorded_at);
+"""
+
+BOX_COLUMNS = ("id", "wav", "recording", "recorded_at", "t_start", "t_end", "label", "cx", "cy", "w", "h", "created")
+
+
+class LabelDatabase():
+
+    def __init__(self, path=LABEL_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        #Waits for other writers (e.g. a second labeller) instead of failing, WAL lets readers carry on during writes
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # ---------- Writing ----------
+
+    def replace_chunk(self, wav_path, t_start, labels, chunk_seconds=CHUNK_SECONDS):
+        """
+        Saves the boxes drawn on one chunk, replacing any saved for it before, in a single transaction.
+        labels is a list of dicts with label, cx, cy, w, h (as the labeller keeps them).
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM boxes WHERE wav = ? AND t_start = ?", (wav_path, t_start))
+            self.add_boxes(wav_path, t_start, labels, chunk_seconds)
+
+    def add_boxes(self, wav_path, t_start, labels, chunk_seconds=CHUNK_SECONDS):
+        recording, recorded_at = _recording_time(wav_path, t_start)
+
+        rows = [(wav_path, recording, recorded_at, t_start, t_start + chunk_seconds,
+                 label["label"], label["cx"], label["cy"], label["w"], label["h"]) for label in labels]
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO boxes (wav, recording, recorded_at, t_start, t_end, label, cx, cy, w, h) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                rows
+            )
+
+    def import_csv(self, label_dir=LABELS):
+        """Moves label CSVs written by older versions of the labeller into the database, returns how many boxes."""
+        count = 0
+        for csv_path in sorted(glob.glob(os.path.join(label_dir, "*.csv"))):
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                if next(reader, None) != LABEL_COLUMNS:
+                    continue
+
+                chunks = {}
+                for wav, t_start, label, cx, cy, w, h in reader:
+                    chunks.setdefault((wav, float(t_start)), []).append(
+                        {"label": label, "cx": float(cx), "cy": float(cy), "w": float(w), "h": float(h)})
+
+            for (wav, t_start), labels in chunks.items():
+                self.replace_chunk(wav, t_start, labels)
+                count += len(labels)
+
+        return count
+
+    # ---------- Reading ----------
+
+    def query(self, label=None, recording=None, t0=None, t1=None, start=None, end=None, month=None):
+        """
+        Boxes matching every filter given, as dicts with BOX_COLUMNS keys.
+            recording, t0, t1: boxes in that recording whose chunk overlaps [t0, t1) seconds
+            start, end: datetimes (or ISO strings) the chunk was recorded between
+            month: month number, e.g. month=6 with label="Yellowhammer" for all Yellowhammer boxes in June
+        """
+        conditions, params = [], []
+
+        if label is not None:
+            conditions.append("label = ?")
+            params.append(label)
+        if recording is not None:
+            conditions.append("recording = ?")
+            params.append(recording)
+        if t0 is not None:
+            conditions.append("t_end > ?")
+            params.append(t0)
+        if t1 is not None:
+            conditions.append("t_start < ?")
+            params.append(t1)
+        if start is not None:
+            conditions.append("recorded_at >= ?")
+            params.append(str(start).replace(" ", "T"))
+        if end is not None:
+            conditions.append("recorded_at < ?")
+            params.append(str(end).replace(" ", "T"))
+        if month is not None:
+            conditions.append("substr(recorded_at, 6, 2) = ?")
+            params.append(f"{int(month):02d}")
+
+        sql = "SELECT " + ", ".join(BOX_COLUMNS) + " FROM boxes"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY recording, t_start, id"
+
+        return [dict(zip(BOX_COLUMNS, row)) for row in self.connection.execute(sql, params)]
+
+    def iter_chunks(self):
+        """
+        Streams every labelled chunk from the database in recording order, without loading all boxes at once.
+        Yields (wav path, t_start, list of (label, cx, cy, w, h)).
+        """
+        cursor = self.connection.execute("SELECT wav, t_start, label, cx, cy, w, h FROM boxes ORDER BY wav, t_start, id")
+
+        chunk, boxes = None, []
+        for wav, t_start, label, cx, cy, w, h in cursor:
+            if (wav, t_start) != chunk:
+                if chunk is not None:
+                    yield chunk[0], chunk[1], boxes
+                chunk, boxes = (wav, t_start), []
+            boxes.append((label, cx, cy, w, h))
+
+        if chunk is not None:
+            yield chunk[0], chunk[1], boxes
+
+    def count(self, label=None):
+        if label is None:
+            return self.connection.execute("SELECT COUNT(*) FROM boxes").fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM boxes WHERE label = ?", (label,)).fetchone()[0]
+
+
+def _recording_time(wav_path, t_start):
+    """(recording name, ISO time of the chunk start), the time is None if the file isn't named after when it started."""
+    try:
+        return recording_name(wav_path), (recording_start(wav_path) + timedelta(seconds=t_start)).isoformat()
+    except ValueError:
+        return os.path.splitext(os.path.basename(wav_path))[0], None
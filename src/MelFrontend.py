@@ -0,0 +1,92 @@
+import functools
+
+import numpy as np
+
+from src.Instrumentation import timed
+
+
+class MelFrontend():
+    """
+    Mel spectrogram front-end with the filterbank and window built once, works in float32 throughout.
+    Gives the same output as librosa.feature.melspectrogram with its defaults (hann window, centred frames, power 2).
+    Use get_frontend rather than building these directly so they're shared between callers.
+    """
+
+    def __init__(self, sample_rate, n_fft, n_mels, min_freq, max_freq, hop_length):
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.n_mels = n_mels
+        self.hop_length = hop_length
+
+        #librosa takes a while to import, only needed once per filterbank
+        from librosa.filters import mel
+        self.filterbank = mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels, fmin=min_freq, fmax=max_freq, dtype=np.float32)
+
+        #Periodic hann window, same as scipy.signal.get_window("hann", n_fft) which librosa uses
+        self.window = (0.5 - 0.5*np.cos(2*np.pi*np.arange(n_fft)/n_fft)).astype(np.float32)
+
+    def __call__(self, audio, center=True, block_frames=2048):
+        """
+        Computes the mel spectrogram of one signal, or a batch of equal length signals.
+
+        Parameters
+            audio: array of shape (..., n_samples)
+            center: pad n_fft//2 either side so frame t is centred on sample t*hop_length
+            block_frames: roughly how many frames are windowed and transformed at once, bounds the working memory
+
+        Returns
+            float32 array of shape (..., n_mels, frames)
+        """
+        audio = np.asarray(audio, dtype=np.float32)
+        batch = audio.reshape(-1, audio.shape[-1])
+
+        if center:
+            pad = self.n_fft//2
+            batch = np.pad(batch, ((0, 0), (pad, pad)))
+
+        n_frames = max(0, 1 + (batch.shape[-1] - self.n_fft)//self.hop_length)
+        mel_spectrogram = np.empty((len(batch), self.n_mels, n_frames), dtype=np.float32)
+
+        if n_frames == 0:
+            return mel_spectrogram.reshape(audio.shape[:-1] + (self.n_mels, 0))
+
+        #(batch, frames, n_fft) view of the signal, frames are only copied a block at a time when windowed
+        frames = np.lib.stride_tricks.sliding_window_view(batch, self.n_fft, axis=-1)[:, ::self.hop_length]
+
+        #Short signals (chunks) are grouped together, long signals (whole recordings) are split into blocks of frames
+        item_step = max(1, block_frames//n_frames)
+        frame_step = min(n_frames, block_frames)
+
+        for i in range(0, len(batch), item_step):
+            for f in range(0, n_frames, frame_step):
+                block = frames[i:i+item_step, f:f+frame_step] * self.window
+                stft = np.fft.rfft(block, axis=-1)
+                power = (stft.real**2 + stft.imag**2).astype(np.float32, copy=False)
+
+                mel_spectrogram[i:i+item_step, :, f:f+frame_step] = np.matmul(self.filterbank, power.swapaxes(-1, -2))
+
+        return mel_spectrogram.reshape(audio.shape[:-1] + (self.n_mels, n_frames))
+
+
+@functools.lru_cache(maxsize=16)
+def get_frontend(sample_rate, n_fft, n_mels, min_freq, max_freq, hop_length):
+    """Returns the shared MelFrontend for these parameters, only built the first time they're asked for."""
+    return MelFrontend(sample_rate, n_fft, n_mels, min_freq, max_freq, hop_length)
+
+
+@timed("db")
+def power_to_db(mel_spectrogram, amin=1e-10, top_db=80.0):
+    """
+    float32 version of librosa.power_to_db(mel_spectrogram, ref=np.max).
+    For a batch of shape (..., n_mels, frames) each spectrogram is referenced to its own maximum.
+    """
+    mel_spectrogram = np.asarray(mel_spectrogram, dtype=np.float32)
+
+    spec_db = 10.0*np.log10(np.maximum(mel_spectrogram, amin))
+    ref_db = np.max(spec_db, axis=(-2, -1), keepdims=True) if spec_db.size else 0.0
+    spec_db -= ref_db
+
+    if top_db is not None:
+        np.maximum(spec_db, -top_db, out=spec_db)
+
+    return spec_db
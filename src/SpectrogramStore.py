@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from src.config import SPECTROGRAMS, SPECTROGRAM_CACHE_BYTES
+from src.Instrumentation import stage
+
+"""
+On-disk spectrogram cache. Each recording gets a folder named after the hash of its contents, holding one .npy shard
+of shape (n_chunks, n_mels, frames) per set of spectrogram parameters. Shards are memory-mapped when read so a cache hit
+only pages in the chunks that are used.
+"""
+
+#(path, size, mtime) -> hash, saves re-hashing the same recording every time a shard is looked up
+_file_hashes = {}
+
+
+def file_hash(file_path, block_size=1<<20):
+    """sha1 of the file contents, only recomputed if the file's size or modification time changes."""
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+    if key not in _file_hashes:
+        sha = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()
+
+    return _file_hashes[key]
+
+
+def known_file_hash(file_path):
+    """file_hash if it's already been worked out for the file as it is now, otherwise None. Never reads the file."""
+    stat = os.stat(file_path)
+    return _file_hashes.get((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns))
+
+
+def params_hash(params):
+    """Short hash of a dict of spectrogram parameters, key order doesn't matter."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class SpectrogramStore():
+
+    def __init__(self, root=SPECTROGRAMS, max_bytes=SPECTROGRAM_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+        #Shards being filled a chunk at a time are kept open, (shard path) -> (spectrograms, filled mask)
+        self._open_shards = {}
+        self._lock = threading.Lock()
+
+    def shard_path(self, source, params):
+        return os.path.join(self.root, file_hash(source), params_hash(params) + ".npy")
+
+    # ---------- Whole recordings ----------
+
+    def load(self, source, params):
+        """
+        Returns the memory-mapped spectrograms for a recording, or None if they haven't been stored.
+        Shards that are still being filled chunk by chunk count as missing.
+        """
+        path = self.shard_path(source, params)
+
+        if not os.path.exists(path) or os.path.exists(_filled_path(path)):
+            return None
+
+        touch(path)
+        return np.load(path, mmap_mode="r")
+
+    def save(self, source, params, spectrograms):
+        """Stores all of a recording's spectrograms as one shard, returns them memory-mapped from disk."""
+        path = self.shard_path(source, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with stage("disk_write", source, spectrograms.nbytes):
+            save_npy(path, np.ascontiguousarray(spectrograms))
+
+        with self._lock:
+            self._open_shards.pop(path, None)
+        if os.path.exists(_filled_path(path)):
+            os.remove(_filled_path(path))
+
+        _write_meta(path, source, params, len(spectrograms))
+        self.evict(keep=path)
+
+        return np.load(path, mmap_mode="r")
+
+    # ---------- Single chunks ----------
+
+    def get_chunk(self, source, params, index):
+        """Returns one chunk's spectrogram, or None if it hasn't been stored."""
+        path = self.shard_path(source, params)
+
+        with self._lock:
+            if path in self._open_shards:
+                spectrograms, filled = self._open_shards[path]
+                return np.array(spectrograms[index]) if filled[index] else None
+
+        if not os.path.exists(path):
+            return None
+
+        if os.path.exists(_filled_path(path)):
+            filled = np.load(_filled_path(path), mmap_mode="r")
+            if not filled[index]:
+                return None
+
+        touch(path)
+        return np.array(np.load(path, mmap_mode="r")[index])
+
+    def put_chunk(self, source, params, index, spectrogram, n_chunks):
+        """
+        Stores one chunk's spectrogram in its recording's shard, the shard is created with room for n_chunks
+        the first time a chunk is put and a mask keeps track of which chunks have been written.
+        """
+        path = self.shard_path(source, params)
+        created = False
+
+        with stage("disk_write", source, spectrogram.nbytes), self._lock:
+            if path not in self._open_shards:
+                self._open_shards[path], created = self._open_for_chunks(path, source, params, spectrogram, n_chunks)
+
+            spectrograms, filled = self._open_shards[path]
+            spectrograms[index] = spectrogram
+            filled[index] = True
+
+            if filled.all():
+                #Complete shards don't need a mask, and can then be read by load
+                spectrograms.flush()
+                del self._open_shards[path]
+                #A shard that was already complete when it was re-opened has no mask left to remove
+                if os.path.exists(_filled_path(path)):
+                    os.remove(_filled_path(path))
+
+        #evict takes the lock itself, so it's only run once put_chunk has let go of it
+        if created:
+            self.evict(keep=path)
+
+    def _open_for_chunks(self, path, source, params, spectrogram, n_chunks):
+        """Returns ((spectrograms, filled mask), whether a new shard was created). Called with the lock held."""
+        filled_path = _filled_path(path)
+
+        if os.path.exists(path) and os.path.exists(filled_path):
+            return (np.load(path, mmap_mode="r+"), np.load(filled_path, mmap_mode="r+")), False
+
+        if os.path.exists(path):
+            #Already complete, re-open so the chunk is simply overwritten
+            return (np.load(path, mmap_mode="r+"), np.ones(n_chunks, dtype=bool)), False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shape = (n_chunks,) + np.shape(spectrogram)
+
+        #Mask first, a shard with no mask beside it counts as complete, so it mustn't exist on its own before then
+        filled = np.lib.format.open_memmap(filled_path, mode="w+", dtype=bool, shape=(n_chunks,))
+        filled.flush()
+        spectrograms = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+        _write_meta(path, source, params, n_chunks)
+
+        return (spectrograms, filled), True
+
+    # ---------- Eviction ----------
+
+    def size(self):
+        return sum(size for _, size, _ in self._shards())
+
+    def evict(self, keep=None):
+        """Removes the least recently used shards until the store is under max_bytes."""
+        if self.max_bytes is None:
+            return
+
+        shards = self._shards()
+        total = sum(size for _, size, _ in shards)
+
+        for path, size, _ in sorted(shards, key=lambda shard: shard[2]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+
+            with self._lock:
+                if path in self._open_shards:
+                    continue
+
+            for file in (path, _filled_path(path), _meta_path(path)):
+                if os.path.exists(file):
+                    os.remove(file)
+            total -= size
+
+    def _shards(self):
+        """(path, bytes, last used) of every shard in the store."""
+        shards = []
+        if not os.path.isdir(self.root):
+            return shards
+
+        for recording in os.scandir(self.root):
+            if not recording.is_dir() or len(recording.name) != 40:
+                continue
+
+            for entry in os.scandir(recording.path):
+                name = entry.name
+                if not name.endswith(".npy") or name.endswith(".filled.npy") or name.endswith(".tmp.npy"):
+                    continue
+
+                size = entry.stat().st_size
+                if os.path.exists(_filled_path(entry.path)):
+                    size += os.path.getsize(_filled_path(entry.path))
+                shards.append((entry.path, size, entry.stat().st_mtime))
+
+        return shards
+
+
+def shard_state(path):
+    """"complete", "partial" (chunks still being filled in) or None when the shard isn't in the store, e.g. it was evicted."""
+    if not os.path.exists(path):
+        return None
+    return "partial" if os.path.exists(_filled_path(path)) else "complete"
+
+
+def _filled_path(path):
+    return path[:-len(".npy")] + ".filled.npy"
+
+
+def _meta_path(path):
+    return path[:-len(".npy")] + ".json"
+
+
+def _write_meta(path, source, params, n_chunks):
+    """Small sidecar so shards can be traced back to their recording without re-hashing audio."""
+    with open(_meta_path(path), "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(source), "params": params, "n_chunks": n_chunks}, f)
+
+
+def touch(path):
+    """Marks a cached file as just used, modification time is used as the last access time for LRU eviction."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def save_npy(path, array):
+    """
+    np.save under a temporary name then renamed into place, so a half written file is never read. The temporary name
+    is unique, processes writing the same file at once each write their own and the last rename wins.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp.npy", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,184 @@
+import json
+import os
+
+import numpy as np
+
+from src.AudioLoader import load_audio
+from src.config import PYRAMIDS, TARGET_SAMPLE_RATE, N_FFT, HOP, N_MELS, MIN_FREQ
+from src.Instrumentation import stage
+from src.MelFrontend import get_frontend
+from src.SpectrogramStore import file_hash, params_hash
+
+"""
+Whole-recording mel spectrogram at several time scales, for zooming and panning in the labeller like a map viewer.
+Level 0 has a frame every HOP samples (what a 3 second chunk shows), each level above halves the number of frames
+by keeping the louder of each pair, so short calls still stand out in the overview. Levels stop once the whole
+recording fits in OVERVIEW_FRAMES.
+
+Levels are saved as (frames, n_mels) .npy files under PYRAMIDS/<recording hash>/<params hash>/ and memory-mapped,
+so a view only reads the frames on screen. view() picks the level with no more than VIEW_FRAMES in the window,
+so how long it takes depends on the window size, not the length of the recording.
+"""
+
+#Frames computed or pooled at a time while building, bounds the memory a build uses
+BUILD_BLOCK_FRAMES = 8192
+
+#Levels stop halving once the whole recording fits in this many frames
+OVERVIEW_FRAMES = 1024
+
+#Most frames view() returns, around the width of the figure in pixels
+VIEW_FRAMES = 2048
+
+META_NAME = "pyramid.json"
+
+
+class TilePyramid():
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.params = meta["params"]
+        self.sample_rate = self.params["sample_rate"]
+        self.duration = meta["duration"]
+        #Seconds between level 0 frames
+        self.hop_seconds = self.params["hop_length"]/self.sample_rate
+
+        self.levels = [np.load(_level_path(directory, level), mmap_mode="r") for level in range(meta["levels"])]
+
+    @staticmethod
+    def pyramid_params(sample_rate):
+        """Same spectrogram settings as the labeller's chunks, so the bottom level matches them."""
+        return {
+            "mode": "pyramid",
+            "sample_rate": sample_rate,
+            "n_fft": N_FFT,
+            "n_mels": N_MELS,
+            "hop_length": HOP,
+            "min_freq": MIN_FREQ,
+            "max_freq": min(sample_rate/2, 150000),
+        }
+
+    @classmethod
+    def directory_for(cls, source, sample_rate, root=PYRAMIDS):
+        return os.path.join(root, file_hash(source), params_hash(cls.pyramid_params(sample_rate)))
+
+    @classmethod
+    def open(cls, source, sr=TARGET_SAMPLE_RATE, root=PYRAMIDS):
+        """The recording's pyramid if it's been built, otherwise None."""
+        import soundfile as sf
+
+        sample_rate = sf.info(source).samplerate if sr is None else int(sr)
+        directory = cls.directory_for(source, sample_rate, root)
+
+        #The meta file is written last, a build that didn't finish has none
+        meta_path = os.path.join(directory, META_NAME)
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, encoding="utf-8") as f:
+            return cls(directory, json.load(f))
+
+    @classmethod
+    def get(cls, source, sr=TARGET_SAMPLE_RATE, root=PYRAMIDS):
+        """Opens the recording's pyramid, building it first if it hasn't been."""
+        pyramid = cls.open(source, sr, root)
+        return pyramid if pyramid is not None else cls.build(source, sr, root)
+
+    @classmethod
+    def build(cls, source, sr=TARGET_SAMPLE_RATE, root=PYRAMIDS):
+        """Computes every level of the recording's pyramid and saves them, a block of frames at a time."""
+        audio, sample_rate = load_audio(source, sr)
+        params = cls.pyramid_params(sample_rate)
+        directory = cls.directory_for(source, sample_rate, root)
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, META_NAME)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        with stage("pyramid", source, audio.nbytes):
+            levels = [_mel_level(audio, params, _level_path(directory, 0))]
+            while len(levels[-1]) > OVERVIEW_FRAMES:
+                levels.append(_halve(levels[-1], _level_path(directory, len(levels))))
+
+            for level in levels:
+                level.flush()
+
+        meta = {"source": os.path.abspath(source), "params": params, "duration": len(audio)/sample_rate, "levels": len(levels)}
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        return cls(directory, meta)
+
+    def frame_seconds(self, level):
+        return self.hop_seconds * 2**level
+
+    def level_for(self, seconds, max_frames=VIEW_FRAMES):
+        """Finest level showing this many seconds in no more than max_frames frames."""
+        level = 0
+        while level < len(self.levels) - 1 and seconds/self.frame_seconds(level) > max_frames:
+            level += 1
+
+        return level
+
+    def view(self, t0, t1, max_frames=VIEW_FRAMES):
+        """
+        Mel power spectrogram covering t0 -> t1 seconds, at the finest level that fits in max_frames.
+
+        Returns
+            (float32 array of shape (n_mels, frames), left edge in seconds, right edge in seconds)
+        """
+        level = self.level_for(t1 - t0, max_frames)
+        frame_seconds = self.frame_seconds(level)
+        tiles = self.levels[level]
+
+        f0 = max(0, int(np.floor(t0/frame_seconds)))
+        f1 = min(len(tiles), int(np.ceil(t1/frame_seconds)) + 1)
+        spectrogram = np.array(tiles[f0:f1]).T
+
+        #Level 0 frames are centred on their hop, so each frame starts half a hop before it
+        offset = self.hop_seconds/2
+        return spectrogram, f0*frame_seconds - offset, f1*frame_seconds - offset
+
+
+def _level_path(directory, level):
+    return os.path.join(directory, f"level_{level}.npy")
+
+
+def _mel_level(audio, params, path):
+    """Level 0: centred frames over the whole recording, with the same zero padding at the ends as center=True."""
+    frontend = get_frontend(params["sample_rate"], params["n_fft"], params["n_mels"], params["min_freq"], params["max_freq"], params["hop_length"])
+    n_fft, hop = params["n_fft"], params["hop_length"]
+    pad = n_fft//2
+
+    n_frames = 1 + len(audio)//hop
+    level = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n_frames, params["n_mels"]))
+
+    for f0 in range(0, n_frames, BUILD_BLOCK_FRAMES):
+        f1 = min(n_frames, f0 + BUILD_BLOCK_FRAMES)
+
+        #Samples under frames f0 -> f1, zeros past either end of the recording
+        i0 = f0*hop - pad
+        i1 = (f1 - 1)*hop + n_fft - pad
+        segment = np.zeros(i1 - i0, dtype=np.float32)
+        r0, r1 = max(0, i0), min(len(audio), i1)
+        segment[r0-i0:r1-i0] = audio[r0:r1]
+
+        level[f0:f1] = frontend(segment, center=False).T
+
+    return level
+
+
+def _halve(previous, path):
+    """Next level up, the max of each pair of frames. An odd last frame is paired with itself."""
+    n_mels = previous.shape[1]
+    level = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=((len(previous) + 1)//2, n_mels))
+
+    step = 2*BUILD_BLOCK_FRAMES
+    for f0 in range(0, len(previous), step):
+        block = np.asarray(previous[f0:f0+step])
+        if len(block) % 2:
+            block = np.concatenate((block, block[-1:]))
+
+        level[f0//2:f0//2 + len(block)//2] = block.reshape(-1, 2, n_mels).max(axis=1)
+
+    return level
@@ -0,0 +1,289 @@
+import json
+import multiprocessing as mp
+import os
+import queue
+
+import numpy as np
+
+from src.config import SPECTROGRAMS, LABEL_DB, CLASSES
+from src.LabelDatabase import LabelDatabase
+from src.MelFrontend import power_to_db
+
+"""
+Feeds labelled chunks to training straight from the spectrogram store, nothing is decoded or recomputed.
+
+Each labelled chunk in the label database is matched to its row in the recording's stored shard (as written by
+preprocess_wav). Worker processes each take a share of the recordings, open each shard once as a memmap and read its
+labelled rows a sorted block at a time. The main process mixes the blocks through a shuffle buffer and copies samples
+straight into each batch (pinned when torch has CUDA, so copies to the GPU can be async). Every batch is newly allocated
+and belongs to the caller, so batches can be kept or copied asynchronously.
+
+    loader = TrainingLoader(batch_size=64, workers=4)
+    for epoch in range(10):
+        for spectrograms, targets in loader:
+            ...
+"""
+
+#Labelled chunks a worker reads from a shard at a time
+BLOCK_CHUNKS = 64
+
+#Memory the shuffle buffer is sized to fill when shuffle_buffer isn't given, 256 MB is ~900 full size spectrograms
+SHUFFLE_BUFFER_BYTES = 256 * 1024**2
+
+
+def find_samples(root=SPECTROGRAMS, db_path=LABEL_DB, modes=("batch", "chunk"), classes=CLASSES):
+    """
+    Matches the labelled chunks in the label database to their spectrograms in the store.
+    Chunks labelled off the make_chunks grid (not a whole number of 1 second hops in) have no stored row and are skipped.
+
+    Parameters
+        modes: which stored spectrograms to use, in order of preference, see WavController.spectrogram_params
+
+    Returns
+        list of (shard path, chunk indices, (n, len(classes)) float32 multi-hot targets), one per recording
+    """
+    shards = _stored_shards(root, modes)
+
+    label_db = LabelDatabase(db_path)
+    try:
+        chunks = list(label_db.iter_chunks())
+    finally:
+        label_db.close()
+
+    samples = {}
+    for wav, t_start, boxes in chunks:
+        shard = shards.get(_path_key(wav))
+        if shard is None:
+            continue
+
+        path, hop_seconds, n_chunks, filled = shard
+        index = int(round(t_start/hop_seconds))
+        if abs(index*hop_seconds - t_start) > 1e-3 or not 0 <= index < n_chunks:
+            continue
+        if filled is not None and not filled[index]:
+            continue
+
+        target = np.zeros(len(classes), dtype=np.float32)
+        for label, *_ in boxes:
+            if label in classes:
+                target[classes.index(label)] = 1.0
+
+        indices, targets = samples.setdefault(path, ([], []))
+        indices.append(index)
+        targets.append(target)
+
+    return [(path, np.array(indices, dtype=np.intp), np.stack(targets)) for path, (indices, targets) in samples.items()]
+
+
+def _path_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _stored_shards(root, modes):
+    """(recording path) -> (shard path, seconds between chunks, n_chunks, filled mask or None), from the shards' meta sidecars."""
+    shards = {}
+    if not os.path.isdir(root):
+        return shards
+
+    for recording in os.scandir(root):
+        if not recording.is_dir() or len(recording.name) != 40:
+            continue
+
+        for entry in os.scandir(recording.path):
+            if not entry.name.endswith(".json"):
+                continue
+
+            with open(entry.path, encoding="utf-8") as f:
+                meta = json.load(f)
+            params = meta["params"]
+            path = entry.path[:-len(".json")] + ".npy"
+            if params.get("mode") not in modes or not os.path.exists(path):
+                continue
+
+            key = _path_key(meta["source"])
+            if key in shards and modes.index(shards[key][4]) <= modes.index(params["mode"]):
+                continue
+
+            #Chunks start a third of a chunk apart, the same as WavController.make_chunks
+            hop_seconds = (int(params["chunk_length"]*params["sample_rate"])//3)/params["sample_rate"]
+            filled_path = path[:-len(".npy")] + ".filled.npy"
+            filled = np.load(filled_path, mmap_mode="r") if os.path.exists(filled_path) else None
+
+            shards[key] = (path, hop_seconds, meta["n_chunks"], filled, params["mode"])
+
+    return {key: shard[:4] for key, shard in shards.items()}
+
+
+def _shard_blocks(samples, db):
+    """Yields (spectrograms, targets) blocks from each shard in samples, each shard is opened once."""
+    for path, indices, targets in samples:
+        spectrograms = np.load(path, mmap_mode="r")
+
+        #Sorted so each block reads forwards through the file
+        order = np.argsort(indices, kind="stable")
+        for start in range(0, len(order), BLOCK_CHUNKS):
+            block = order[start:start+BLOCK_CHUNKS]
+            spectrogram_block = np.asarray(spectrograms[indices[block]], dtype=np.float32)
+            yield (power_to_db(spectrogram_block) if db else spectrogram_block), targets[block]
+
+
+def _worker(samples, db, out_queue):
+    """Worker process: puts every block of its shards on out_queue, then None."""
+    try:
+        for block in _shard_blocks(samples, db):
+            out_queue.put(block)
+    except Exception as e:
+        out_queue.put(RuntimeError(f"Training loader worker failed: {e}"))
+    out_queue.put(None)
+
+
+class TrainingLoader():
+
+    def __init__(self, samples=None, batch_size=64, shuffle_buffer=None, workers=None, prefetch=4,
+                 pin_memory=True, to_torch=None, db=True, drop_last=False, seed=0):
+        """
+        Parameters
+            samples: from find_samples, found with its defaults if not given
+            shuffle_buffer: samples held back and drawn from at random, bigger mixes recordings more.
+                By default as many as fit in SHUFFLE_BUFFER_BYTES
+            workers: reading processes, 0 reads in this process
+            prefetch: blocks of BLOCK_CHUNKS each worker can have read ahead of training
+            pin_memory: page-lock the batches, only when torch with CUDA is available
+            to_torch: yield torch tensors instead of numpy arrays, by default whenever torch is installed
+            db: convert the stored power spectrograms to dB, as the InferenceEngine does
+        """
+        self.samples = samples if samples is not None else find_samples()
+        if not self.samples:
+            raise ValueError("No labelled chunks have stored spectrograms, run preprocess_wav on the labelled recordings first")
+
+        shapes = {np.load(path, mmap_mode="r").shape[1:] for path, _, _ in self.samples}
+        if len(shapes) > 1:
+            raise ValueError(f"Stored spectrograms have different shapes {shapes}, pass samples from one set of parameters")
+        self.shape = shapes.pop()
+        self.n_classes = self.samples[0][2].shape[1]
+
+        self.batch_size = batch_size
+        if shuffle_buffer is None:
+            shuffle_buffer = SHUFFLE_BUFFER_BYTES//(4*int(np.prod(self.shape)))
+        #No point holding back more samples than there are
+        self.shuffle_buffer = max(1, min(shuffle_buffer, sum(len(indices) for _, indices, _ in self.samples)))
+        self.workers = min(len(self.samples), os.cpu_count() or 1, 4) if workers is None else workers
+        self.prefetch = prefetch
+        self.db = db
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+        self.torch = None
+        if to_torch is not False:
+            try:
+                import torch
+                self.torch = torch
+            except ImportError:
+                if to_torch:
+                    raise
+        self.pin_memory = pin_memory and self.torch is not None and self.torch.cuda.is_available()
+
+    def __len__(self):
+        n = sum(len(indices) for _, indices, _ in self.samples)
+        return n//self.batch_size if self.drop_last else -(-n//self.batch_size)
+
+    def __iter__(self):
+        """One epoch, recordings are dealt to the workers in a different order each time."""
+        rng = np.random.default_rng((self.seed, self.epoch))
+        self.epoch += 1
+
+        order = rng.permutation(len(self.samples))
+        shares = [[self.samples[i] for i in order[worker::max(1, self.workers)]] for worker in range(max(1, self.workers))]
+
+        blocks = _shard_blocks(shares[0], self.db) if self.workers == 0 else self._worker_blocks(shares)
+        return self._batches(blocks, rng)
+
+    def _worker_blocks(self, shares):
+        out_queue = mp.Queue(maxsize=self.prefetch*len(shares))
+        processes = [mp.Process(target=_worker, args=(share, self.db, out_queue), daemon=True) for share in shares]
+        for process in processes:
+            process.start()
+
+        try:
+            running = len(processes)
+            while running:
+                try:
+                    block = out_queue.get(timeout=1.0)
+                except queue.Empty:
+                    #A worker killed outside Python (e.g. out of memory) never sends its None
+                    if not any(process.is_alive() for process in processes):
+                        raise RuntimeError("Training loader workers exited without finishing")
+                    continue
+
+                if block is None:
+                    running -= 1
+                elif isinstance(block, Exception):
+                    raise block
+                else:
+                    yield block
+        finally:
+            #Also reached when training stops part way through an epoch
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    def _new_batch(self):
+        """(spectrograms, targets) to write into, and the same memory as what's yielded (tensors or arrays)."""
+        spectrograms = np.empty((self.batch_size,) + self.shape, dtype=np.float32)
+        targets = np.empty((self.batch_size, self.n_classes), dtype=np.float32)
+
+        if self.torch is None:
+            return spectrograms, targets, spectrograms, targets
+
+        out_spectrograms = self.torch.from_numpy(spectrograms)
+        out_targets = self.torch.from_numpy(targets)
+        if self.pin_memory:
+            out_spectrograms, out_targets = out_spectrograms.pin_memory(), out_targets.pin_memory()
+
+        return out_spectrograms.numpy(), out_targets.numpy(), out_spectrograms, out_targets
+
+    def _batches(self, blocks, rng):
+        buffer = np.empty((self.shuffle_buffer,) + self.shape, dtype=np.float32)
+        buffer_targets = np.empty((self.shuffle_buffer, self.n_classes), dtype=np.float32)
+        filled = 0
+
+        #A new batch each time, never one that's been yielded, the caller may still be holding on to it
+        spectrograms, targets, out_spectrograms, out_targets = self._new_batch()
+        n = 0
+
+        def take(j):
+            nonlocal n
+            spectrograms[n] = buffer[j]
+            targets[n] = buffer_targets[j]
+            n += 1
+
+        for block_spectrograms, block_targets in blocks:
+            for spectrogram, target in zip(block_spectrograms, block_targets):
+                #Fill the buffer first, after that each new sample swaps out a random one
+                if filled < self.shuffle_buffer:
+                    buffer[filled] = spectrogram
+                    buffer_targets[filled] = target
+                    filled += 1
+                    continue
+
+                j = rng.integers(filled)
+                take(j)
+                buffer[j] = spectrogram
+                buffer_targets[j] = target
+
+                if n == self.batch_size:
+                    yield out_spectrograms, out_targets
+                    spectrograms, targets, out_spectrograms, out_targets = self._new_batch()
+                    n = 0
+
+        for j in rng.permutation(filled):
+            take(j)
+            if n == self.batch_size:
+                yield out_spectrograms, out_targets
+                spectrograms, targets, out_spectrograms, out_targets = self._new_batch()
+                n = 0
+
+        if n and not self.drop_last:
+            yield out_spectrograms[:n], out_targets[:n]
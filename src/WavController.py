@@ -1,22 +1,37 @@
 import os
-from librosa.filters import mel
-import librosa.display
 import numpy as np
-import matplotlib.pyplot as plt
+import soundfile as sf
 
-from src.config import WAV_CHUNKS, SPECTROGRAMS, PREPROCESSED
+from src.AudioLoader import load_audio
+from src.config import WAV_CHUNKS, PREPROCESSED, TARGET_SAMPLE_RATE
+from src.DetectionIndex import DetectionIndex
+from src.Instrumentation import stage
+from src.MelFrontend import get_frontend, power_to_db
+from src.SpectrogramStore import SpectrogramStore
+
+#Frames each 1 second hop is split into by detect_activity, short enough to fall in the gaps between calls
+ACTIVITY_FRAMES = 20
 
 class WavController():
 
 
-    def __init__(self, file_path=None, chunk_length=3):
+    def __init__(self, file_path=None, chunk_length=3, stream=False, store=None, sample_rate=TARGET_SAMPLE_RATE, cache=True):
         self.chunk_length = chunk_length
         self.file_path = file_path
+        #Rate audio is loaded at, None for the file's native rate
+        self.target_sample_rate = sample_rate
+        #Where create_spectrogram(save=True) reads and writes spectrograms
+        self.store = store if store is not None else SpectrogramStore()
+        #Streaming reads blocks straight from the file at its native sample rate, the audio is never fully loaded
+        self.stream = stream
+        #Whether loaded audio goes through the decoded audio cache, one-off passes over a dataset shouldn't fill it
+        self.cache = cache
         #self.sample_rate, self.audio_data = wavfile.read(file_path)
-        if file_path is not None: self.load_audio(file_path)
+        if file_path is not None and stream: self.audio_data, self.sample_rate = None, self._stream_sample_rate(file_path)
+        elif file_path is not None: self.load_audio(file_path, sample_rate)
         else: self.audio_data, self.sample_rate = None, None
 
-        self.file_name = os.path.basename(file_path).split(".")[0] #[1]
+        self.file_name = os.path.basename(file_path).split(".")[0] if file_path is not None else None #[1]
 
         #Spectrogram parameters, advised by Kahl, C. M. Wood, et al 2021
         self.window_length = 512
@@ -25,46 +40,343 @@ class WavController():
         self.max_freq = 15000
         self.min_freq = 150
 
-    def load_audio(self, file_path):
-        self.audio_data, self.sample_rate = librosa.load(file_path, mono=True, dtype=float)
+        #Filled in by detect_activity, how many chunks were judged silent and the threshold used
+        self.activity_report = None
 
-    def make_chunks(self, overlap=False):
+    def load_audio(self, file_path, sr=TARGET_SAMPLE_RATE):
+        """
+        Loads mono float32 audio through the decoded audio cache (unless cache=False), resampled if sr is given.
+        sr=None keeps the native sample rate, which is what the streaming chunks match.
+        """
+        self.audio_data, self.sample_rate = load_audio(file_path, sr, cache=self.cache)
+
+    def _stream_sample_rate(self, file_path):
+        native_sr = sf.info(file_path).samplerate
+        if self.target_sample_rate is not None and self.target_sample_rate != native_sr:
+            raise ValueError(f"Streaming reads at the native sample rate ({native_sr}), can't stream at {self.target_sample_rate}")
+
+        return native_sr
+
+    def make_chunks(self, overlap=False, skip_silent=False):
         """
         Splits the wav file into chunks, overlapping each clip as to not miss start/end of a bird call.
+        With skip_silent=True chunks detect_activity judges silent are left out, see activity_report for how many.
 
         Returns
-            numpy array of audio chunks
+            numpy array of audio chunks, or a generator of chunks when streaming
         """
+        if skip_silent:
+            with stage("activity", self.file_path):
+                active = self.detect_activity()
+        else:
+            active = None
+
+        if self.stream:
+            chunks = self.stream_chunks()
+            if active is None:
+                return chunks
+            return (chunk for chunk, keep in zip(chunks, active) if keep)
+
         chunk_size = int(self.chunk_length * self.sample_rate)
         overlap_size = chunk_size//3 #1 second of overlap between chunks
 
-        chunks = [
-            self.audio_data[chunk:chunk+chunk_size]
-            for chunk in range(0, len(self.audio_data) - chunk_size + 1, overlap_size)
-        ]
+        with stage("chunking", self.file_path, self.audio_data.nbytes):
+            chunks = [
+                self.audio_data[chunk:chunk+chunk_size]
+                for chunk in range(0, len(self.audio_data) - chunk_size + 1, overlap_size)
+            ]
+
+        if active is not None:
+            chunks = [chunk for chunk, keep in zip(chunks, active) if keep]
 
         return chunks
 
-    def create_spectrogram(self, chunk, save=False):
-        
+    def detection_chunks(self, spans):
+        """
+        Indices of the chunks from make_chunks that overlap at least one detection.
+
+        Parameters
+            spans: (start, end) seconds of each detection, e.g. DetectionIndex.spans(recording_name(file_path))
+        """
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+
+        index = DetectionIndex()
+        index.add_recording(self.file_name, spans)
+
+        t0s = np.arange(self.num_chunks()) * overlap_size / self.sample_rate
+        return np.flatnonzero(index.counts(self.file_name, t0s, t0s + chunk_size/self.sample_rate) > 0)
+
+    def detection_regions(self, indices):
+        """
+        Merges the chunks at indices into (first chunk, last chunk) runs whose audio overlaps or touches,
+        so each run is one contiguous read of the file.
+        """
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+
+        regions = []
+        for i in indices:
+            i = int(i)
+            #Chunk i starts before the end of the last chunk of the run, so its audio is already being read
+            if regions and i*overlap_size <= regions[-1][1]*overlap_size + chunk_size:
+                regions[-1][1] = i
+            else:
+                regions.append([i, i])
+
+        return [tuple(region) for region in regions]
+
+    def make_sparse_chunks(self, spans):
+        """
+        Same chunks as make_chunks, but only the ones overlapping a detection. When the audio isn't loaded
+        (e.g. stream=True) only the stretches of the file under those chunks are read, so a recording with few
+        detections is barely decoded.
+
+        Returns
+            (chunk indices in make_chunks order, list of chunks)
+        """
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+
+        indices = self.detection_chunks(spans)
+        regions = self.detection_regions(indices)
+        chunks = []
+
+        with stage("sparse_read", self.file_path) as timing:
+            for (first, last), region in zip(regions, self._read_regions(regions)):
+                timing.add_bytes(region.nbytes)
+                chunks += [region[(i - first)*overlap_size:(i - first)*overlap_size + chunk_size] for i in range(first, last+1)]
+
+        return indices, chunks
+
+    def create_sparse_spectrograms(self, spans, save=False):
+        """
+        Spectrograms of only the chunks overlapping a detection, see make_sparse_chunks.
+        With save=True each is read from / written to its place in the store's per-chunk shard for this recording.
+
+        Returns
+            (chunk indices in make_chunks order, array of shape (n_chunks, n_mels, frames))
+        """
+        indices, chunks = self.make_sparse_chunks(spans)
+
+        if not chunks:
+            chunk_frames = 1 + int(self.chunk_length * self.sample_rate)//self.overlap
+            return indices, np.empty((0, self.num_mel_bands, chunk_frames), dtype=np.float32)
+
+        if save:
+            return indices, np.stack([self.create_spectrogram(chunk, save=True, index=int(i)) for i, chunk in zip(indices, chunks)])
+
+        return indices, self.create_spectrogram(np.stack(chunks))
+
+    def _read_regions(self, regions):
+        """Audio under each (first chunk, last chunk) run, sliced from memory if loaded, otherwise seeked to in the file."""
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+
+        if self.audio_data is not None:
+            for first, last in regions:
+                yield self.audio_data[first*overlap_size:last*overlap_size + chunk_size]
+            return
+
+        with sf.SoundFile(self.file_path) as wav:
+            for first, last in regions:
+                wav.seek(first*overlap_size)
+                block = wav.read(last*overlap_size + chunk_size - first*overlap_size, dtype="float32", always_2d=True)
+                #Same channel average as stream_chunks
+                yield np.mean(block, axis=1)
+
+    def detect_activity(self, floor_percentile=15, margin_db=6.0, min_chunks=10, block_seconds=60):
+        """
+        Cheap check for which chunks might have a call in them, before paying for their spectrograms.
+        The audio is band-pass filtered to min_freq -> max_freq and split into short frames. The noise floor is a low
+        percentile of the frame energies (even a busy dawn chorus has gaps between calls), and a chunk is active if its
+        loudest frame is more than margin_db above it. Recordings under min_chunks chunks are too short to estimate
+        a floor from, so every chunk is kept.
+
+        Returns
+            boolean array, one per chunk from make_chunks, True for chunks worth keeping
+        """
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+        hops_per_chunk = chunk_size//overlap_size
+        n_chunks = self.num_chunks()
+
+        if n_chunks < min_chunks:
+            self.activity_report = {"chunks": int(n_chunks), "skipped": 0, "threshold_db": None}
+            return np.ones(n_chunks, dtype=bool)
 
-        mel_spectrogram = librosa.feature.melspectrogram(
-            y=chunk, 
-            sr=self.sample_rate, 
-            n_fft=self.window_length, 
-            n_mels=self.num_mel_bands, 
-            hop_length=self.overlap,
-            fmin = self.min_freq,
-            fmax = self.max_freq
-        )
+        #(hops, ACTIVITY_FRAMES) mean energy of each short frame in each 1 second hop
+        frame_db = 10*np.log10(self._hop_energy(overlap_size, block_seconds) + 1e-12)
 
+        threshold = np.percentile(frame_db, floor_percentile) + margin_db
+
+        #A chunk's loudest frame is the loudest of the three hops it covers
+        hop_peak = frame_db.max(axis=1)
+        chunk_peak = np.lib.stride_tricks.sliding_window_view(hop_peak, hops_per_chunk).max(axis=1)[:n_chunks]
+
+        active = chunk_peak > threshold
+        self.activity_report = {"chunks": int(n_chunks), "skipped": int(n_chunks - active.sum()), "threshold_db": float(threshold)}
+
+        return active
+
+    def _hop_energy(self, overlap_size, block_seconds):
+        """Mean squared band-passed sample of each short frame, (hops, ACTIVITY_FRAMES), filtered a block at a time to bound memory."""
+        #scipy.signal is slow to import and only the activity filter needs it
+        from scipy.signal import butter
+
+        #Upper edge kept under Nyquist for low sample rates
+        high = min(self.max_freq, 0.45*self.sample_rate)
+        sos = butter(4, [self.min_freq, high], btype="bandpass", fs=self.sample_rate, output="sos")
+        state = np.zeros((sos.shape[0], 2))
+
+        block_size = overlap_size * max(1, int(block_seconds * self.sample_rate)//overlap_size)
+
+        if self.stream:
+            with sf.SoundFile(self.file_path) as wav:
+                blocks = (np.mean(block, axis=1) for block in wav.blocks(blocksize=block_size, dtype="float32", always_2d=True))
+                return self._filtered_hop_energy(blocks, sos, state, overlap_size)
+
+        blocks = (self.audio_data[i:i+block_size] for i in range(0, len(self.audio_data), block_size))
+        return self._filtered_hop_energy(blocks, sos, state, overlap_size)
+
+    def _filtered_hop_energy(self, blocks, sos, state, overlap_size):
+        from scipy.signal import sosfilt
+
+        frame_size = overlap_size//ACTIVITY_FRAMES
+        energy = []
+        for block in blocks:
+            filtered, state = sosfilt(sos, block, zi=state)
+            #Whole hops only, blocks are a multiple of the hop so only the final partial hop is dropped
+            n_hops = len(filtered)//overlap_size
+            hops = filtered[:n_hops*overlap_size].reshape(n_hops, overlap_size)[:, :ACTIVITY_FRAMES*frame_size]
+            energy.append(np.mean(np.square(hops).reshape(n_hops, ACTIVITY_FRAMES, frame_size), axis=2))
+
+        return np.concatenate(energy) if energy else np.zeros((0, ACTIVITY_FRAMES))
+
+    def stream_chunks(self, block_chunks=64):
+        """
+        Generator version of make_chunks, reads the file in blocks so memory stays the same for any recording length.
+        The end of each block is carried over to the next so chunks crossing a block edge are still complete.
+        Yields the same chunks as make_chunks on audio loaded at the native rate, load_audio(file_path, sr=None).
+
+        Parameters
+            block_chunks: number of chunk hops read from the file at a time
+        """
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+
+        #Each block holds block_chunks whole chunks, the last chunk_size - overlap_size samples are re-used by the next block
+        block_size = chunk_size + (block_chunks - 1) * overlap_size
+        carry = chunk_size - overlap_size
+
+        with sf.SoundFile(self.file_path) as wav:
+            for block in wav.blocks(blocksize=block_size, overlap=carry, dtype="float32", always_2d=True):
+                #Same channel average librosa uses for mono=True
+                block = np.mean(block, axis=1)
+
+                for chunk in range(0, len(block) - chunk_size + 1, overlap_size):
+                    yield block[chunk:chunk+chunk_size]
+
+    def frontend(self):
+        """Shared mel front-end for this controller's spectrogram parameters, the filterbank is only built once."""
+        #Mel bands above Nyquist would be empty at low sample rates
+        max_freq = min(self.max_freq, self.sample_rate/2)
+        return get_frontend(self.sample_rate, self.window_length, self.num_mel_bands, self.min_freq, max_freq, self.overlap)
+
+    def spectrogram_params(self, mode="chunk"):
+        """
+        Everything that changes the stored spectrograms, used as part of the cache key.
+        mode separates per-chunk spectrograms from create_spectrogram_batch, their edge frames differ.
+        """
+        return {
+            "mode": mode,
+            "sample_rate": self.sample_rate,
+            "chunk_length": self.chunk_length,
+            "n_fft": self.window_length,
+            "n_mels": self.num_mel_bands,
+            "hop_length": self.overlap,
+            "min_freq": self.min_freq,
+            "max_freq": self.max_freq,
+        }
+
+    def num_chunks(self):
+        """Number of chunks make_chunks gives for the loaded (or streamed) file."""
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+
+        n_samples = sf.info(self.file_path).frames if self.stream else len(self.audio_data)
+        return max(0, (n_samples - chunk_size)//overlap_size + 1)
+
+    def create_spectrogram(self, chunk, save=False, index=None):
+        """
+        Mel spectrogram of a chunk, or a (n_chunks, samples) batch of chunks, as float32.
+        With save=True the chunk's position from make_chunks must be given as index,
+        the spectrogram is then read from the store if it's there and written to it if not.
+        """
+        if save:
+            if index is None:
+                raise ValueError("index of the chunk is needed to save its spectrogram")
+
+            params = self.spectrogram_params()
+            mel_spectrogram = self.store.get_chunk(self.file_path, params, index)
+            if mel_spectrogram is not None:
+                return mel_spectrogram
+
+        with stage("mel", self.file_path, chunk.nbytes):
+            mel_spectrogram = self.frontend()(chunk)
 
         if save:
-            pass
-            #TODO: save specs
+            self.store.put_chunk(self.file_path, params, index, mel_spectrogram, self.num_chunks())
 
         return mel_spectrogram
 
+    def create_spectrogram_batch(self, save=False):
+        """
+        Runs a single mel pass over the whole recording rather than one per chunk, each sample is only transformed once.
+        Each chunk is then a slice of frames from the full spectrogram, lined up with the chunks from make_chunks.
+
+        Frames are only a zero-copy view when the 1 second chunk hop is a whole number of STFT hops (e.g. 48kHz),
+        otherwise the chunk start frames are rounded and gathered into a new array.
+        Frames at the edges of each chunk see the neighbouring audio instead of padding, so will differ slightly from create_spectrogram.
+
+        With save=True the recording's spectrograms are read from the store if they're there, and written to it if not.
+
+        Returns
+            numpy array of spectrograms, shape (n_chunks, n_mels, frames)
+        """
+        if save:
+            params = self.spectrogram_params("batch")
+            stored = self.store.load(self.file_path, params)
+            if stored is not None:
+                return stored
+
+            return self.store.save(self.file_path, params, self.create_spectrogram_batch())
+
+        chunk_size = int(self.chunk_length * self.sample_rate)
+        overlap_size = chunk_size//3
+        n_chunks = (len(self.audio_data) - chunk_size)//overlap_size + 1
+
+        with stage("mel", self.file_path, self.audio_data.nbytes):
+            mel_spectrogram = self.frontend()(self.audio_data)
+
+        #Same number of frames create_spectrogram gives for a single chunk
+        chunk_frames = 1 + chunk_size//self.overlap
+
+        if n_chunks < 1:
+            return np.empty((0, self.num_mel_bands, chunk_frames), dtype=mel_spectrogram.dtype)
+
+        if overlap_size % self.overlap == 0:
+            frame_step = overlap_size//self.overlap
+            #(n_mels, windows, chunk_frames) view over the full spectrogram, no data is copied
+            windows = np.lib.stride_tricks.sliding_window_view(mel_spectrogram, chunk_frames, axis=1)
+            return windows[:, ::frame_step][:, :n_chunks].transpose(1, 0, 2)
+
+        starts = np.rint(np.arange(n_chunks) * overlap_size / self.overlap).astype(np.intp)
+        starts = np.minimum(starts, mel_spectrogram.shape[1] - chunk_frames)
+        frames = starts[:, None] + np.arange(chunk_frames)
+
+        return mel_spectrogram[:, frames].transpose(1, 0, 2)
+
     def save_chunks(self, chunks):
         if not os.path.exists(WAV_CHUNKS / self.file_name):
             os.makedirs(WAV_CHUNKS / self.file_name)
@@ -73,13 +385,17 @@ class WavController():
 
 
 if __name__ == "__main__":
+    #Only the demo plots, so these aren't imported with the module
+    import librosa.display
+    import matplotlib.pyplot as plt
+
     wav_controller = WavController(PREPROCESSED + "Weaveley_BIRD_HedgerowNorth_20240605_184000.WAV")
     chunks = wav_controller.make_chunks()
 
     y = chunks[100]
 
     mel_spec = wav_controller.create_spectrogram(y)
-    mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
+    mel_spec_db = power_to_db(mel_spec)
 
     fig, ax = plt.subplots(3, 1, figsize=(25,20), constrained_layout=True)
 
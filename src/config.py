@@ -9,12 +9,74 @@ WAV_CHUNKS = WAV_PATH + "wav_chunks\\"
 FULL_WAV = WAV_PATH + "full_wav\\"
 
 LABELS = DATA_PATH + "labels\\"
+LABEL_DB = LABELS + "labels.sqlite"
 SPECTROGRAMS = DATA_PATH + "spectrograms\\"
+#Zoomable whole-recording spectrograms for the labeller, see TilePyramid
+PYRAMIDS = SPECTROGRAMS + "pyramids\\"
 PREPROCESSED = DATA_PATH + "preprocessed_wav\\"
+PCM_CACHE = DATA_PATH + "pcm_cache\\"
+
+#Sample rate audio is loaded at, None keeps the recording's own rate (no resampling)
+#Needs to be at least 2*max_freq (30000) for the top of the spectrogram to be filled
+TARGET_SAMPLE_RATE = None
 
 #We should review this closer to end time, probably bad to require external file structure
 # CSV_DATA = PROJECT_ROOT + "..\\csv_bird_data\\"
 
 CSV_DATA = DATA_PATH + "csv_files\\"
 FULL_CSV = CSV_DATA + "full_csv\\"
-SPLIT_CSV = CSV_DATA + "split_csv\\"
\ No newline at end of file
+SPLIT_CSV = CSV_DATA + "split_csv\\"
+
+#Column positions in the BirdNET CSVs, start/end are "dd/mm/yyyy hh:mm" (seconds optional) or seconds into the recording
+CSV_START = 0
+CSV_END = 1
+CSV_LOCATION = 2
+CSV_SCI_NAME = 3
+CSV_COMMON_NAME = 4
+CSV_CONFIDENCE = 5
+
+#The master export decompile_csv reads has the same columns in another order, (column above) -> master column.
+#decompile_csv writes the per-location CSVs in the layout above, so everything after it only uses CSV_*
+MASTER_CSV_COLUMNS = {CSV_START: 0, CSV_END: 1, CSV_CONFIDENCE: 2, CSV_SCI_NAME: 3, CSV_COMMON_NAME: 4, CSV_LOCATION: 5}
+
+#Labeller chunk and spectrogram settings, shared with label_spectrograms so exported images match what was labelled
+CHUNK_SECONDS = 3.0
+N_FFT = 512
+HOP = N_FFT//4
+N_MELS = 64
+MIN_FREQ = 150
+MAX_FREQ = 15000
+#Chunks starting on this grid are the same as WavController's, so their spectrograms are cached
+CHUNK_HOP = CHUNK_SECONDS/3
+#Audio either side of a chunk read for the edge frames of the STFT, instead of padding it with zeros
+STFT_PAD = N_FFT//2
+
+CLASSES = ["Eurasian_Skylark", "Yellowhammer", "European Goldfinch", 
+        "Eurasian Linnet", "European Robin", "Spotted Flycatcher", "Dunnock", 
+        "Eurasian Magpie", "Unknown Bird"]
+DEFAULT_CLASS = CLASSES[-1]
+
+#Scientific names written in the Scientific name column of the InferenceEngine's CSVs, same as BirdNET's
+CLASS_SCI_NAMES = {
+    "Eurasian_Skylark": "Alauda arvensis",
+    "Yellowhammer": "Emberiza citrinella",
+    "European Goldfinch": "Carduelis carduelis",
+    "Eurasian Linnet": "Linaria cannabina",
+    "European Robin": "Erithacus rubecula",
+    "Spotted Flycatcher": "Muscicapa striata",
+    "Dunnock": "Prunella modularis",
+    "Eurasian Magpie": "Pica pica",
+    "Unknown Bird": "Aves",
+}
+
+#Columns of the label CSVs exported by the labeller, cx/cy/w/h are YOLO box coordinates within the chunk
+LABEL_COLUMNS = ["wav", "t_start", "label", "cx", "cy", "w", "h"]
+
+YOLO_DATASET = DATA_PATH + "yolo_dataset\\"
+#Per-recording detection CSVs written by the InferenceEngine, same layout as the split BirdNET CSVs
+INFERENCE_CSV = CSV_DATA + "inference\\"
+
+#Spectrogram cache is trimmed back to this size, least recently used recordings first
+SPECTROGRAM_CACHE_BYTES = 20 * 1024**3
+#Decoded audio cache is trimmed back to this size the same way, a 20 minute 48kHz recording is ~230 MB decoded
+PCM_CACHE_BYTES = 10 * 1024**3
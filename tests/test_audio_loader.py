@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+from src.AudioLoader import evict_pcm_cache, load_audio, read_window
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    paths = []
+    for i in range(4):
+        path = str(tmp_path / f"{i}_48000.npy")
+        np.save(path, np.zeros(1000, dtype=np.float32))
+        os.utime(path, (1000 + i, 1000 + i))
+        paths.append(path)
+
+    #The oldest file was used most recently
+    os.utime(paths[0], (2000, 2000))
+    (tmp_path / "partial.tmp.npy").write_bytes(b"0"*8000)
+
+    evict_pcm_cache(max_bytes=2*os.path.getsize(paths[0]), keep=paths[1], root=str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == ["0_48000.npy", "1_48000.npy", "partial.tmp.npy"]
+
+
+def test_resampled_window_matches_full_resample(tmp_path):
+    native_sr, sample_rate, pad = 48000, 32000, 256
+    path = str(tmp_path / "20240605_184000.wav")
+    t = np.arange(10*native_sr)/native_sr
+    audio = 0.1*np.sin(2*np.pi*(1000 + 300*t)*t) + 0.01*np.random.default_rng(0).standard_normal(len(t))
+    sf.write(path, audio.astype(np.float32), native_sr, subtype="FLOAT")
+
+    full, _ = load_audio(path, sr=sample_rate, cache=False)
+
+    #Starts that don't fall on the resampling grid, and one running off the start of the file
+    for t_start in (0.0, 1.23457, 4.000021, 6.5):
+        window, rate = read_window(path, t_start, t_start + 3.0, sr=sample_rate, pad=pad)
+        start = int(round(t_start*sample_rate)) - pad
+
+        expected = np.zeros(len(window), dtype=np.float32)
+        r0 = max(0, start)
+        expected[r0-start:] = full[r0:start+len(window)]
+
+        assert rate == sample_rate
+        np.testing.assert_allclose(window, expected, atol=1e-4)
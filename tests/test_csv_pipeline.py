@@ -0,0 +1,38 @@
+import csv
+import os
+
+import numpy as np
+
+from benchmarks.fixtures import make_birdnet_csv
+from scripts import decompile_csv, split_csv_files
+
+
+def test_master_export_round_trip(tmp_path, monkeypatch):
+    master = make_birdnet_csv(str(tmp_path / "season.csv"), 500)
+    with open(master, newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.reader(f))[1:]
+
+    #decompile: master export -> one CSV per location
+    csv_files, info_line = decompile_csv.read_csv_parallel(master, workers=2)
+    assert sum(len(instances) for instances in csv_files.values()) == len(rows)
+
+    full_dir = tmp_path / "full_csv"
+    decompile_csv.create_csv(csv_files, info_line, out_dir=str(full_dir))
+    hedgerow = str(full_dir / "Hedgerow North.csv")
+
+    #split: location CSV -> one CSV per 20 minute recording
+    split_dir = tmp_path / "split_csv"
+    monkeypatch.setattr(split_csv_files, "SPLIT_CSV", str(split_dir))
+    split_files, split_info_line, _ = split_csv_files.read_csv(hedgerow)
+    split_csv_files.construct_csv(split_info_line, split_files)
+    split_path = str(split_dir / (sorted(split_files)[0] + ".csv"))
+
+    for path in (hedgerow, split_path):
+        columns = split_csv_files.read_columnar(path)
+
+        assert columns["locations"].tolist() == ["Hedgerow North"]
+        assert not np.isnat(columns["timestamps"]).any()
+        assert ((columns["confidence"] >= 0.1) & (columns["confidence"] <= 1.0)).all()
+        assert all("," in species for species in columns["species"])
+
+    assert os.path.exists(str(full_dir / "North Control Grassland.csv"))
@@ -0,0 +1,84 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from src.config import CLASSES
+from src.InferenceEngine import InferenceEngine
+
+
+def write_recording(directory, name, sample_rate, seconds=10):
+    path = os.path.join(directory, name)
+    audio = 0.01*np.random.default_rng(sample_rate).standard_normal(int(seconds*sample_rate))
+    sf.write(path, audio.astype(np.float32), sample_rate)
+    return path
+
+
+def model(batch):
+    #Every class scores 1 on every chunk, works for any spectrogram shape
+    return np.ones((len(batch), len(CLASSES)), dtype=np.float32)
+
+
+def test_mixed_sample_rates_and_sites(tmp_path):
+    recordings = [
+        write_recording(str(tmp_path), "SiteA_20240605_184000.wav", 48000),
+        write_recording(str(tmp_path), "SiteB_20240605_184000.wav", 22050),
+    ]
+    out_dir = str(tmp_path / "out")
+
+    engine = InferenceEngine(model, max_batch=16, producers=2, out_dir=out_dir, sample_rate=None)
+    summary = engine.run(recordings)
+
+    assert summary["failed"] == 0
+    assert summary["recordings"] == 2
+    assert sorted(os.listdir(out_dir)) == ["SiteA_20240605_184000.csv", "SiteB_20240605_184000.csv"]
+
+
+def test_failing_batch_only_fails_its_recording(tmp_path):
+    recordings = [
+        write_recording(str(tmp_path), "SiteA_20240605_184000.wav", 48000),
+        write_recording(str(tmp_path), "SiteB_20240605_184000.wav", 22050),
+    ]
+
+    def picky_model(batch):
+        if batch.shape[-1] < 1000:
+            raise ValueError("wrong input length")
+        return model(batch)
+
+    engine = InferenceEngine(picky_model, max_batch=16, producers=1, out_dir=str(tmp_path / "out"), sample_rate=None)
+    summary = engine.run(recordings)
+
+    assert summary["recordings"] == 1
+    assert summary["failed"] == 1
+
+
+def test_waiting_batch_runs_while_another_shape_streams(tmp_path):
+    runs = []
+
+    def recording_model(batch):
+        runs.append((batch.shape, time.perf_counter()))
+        return model(batch)
+
+    engine = InferenceEngine(recording_model, max_batch=1000, max_wait=0.05, out_dir=str(tmp_path / "out"))
+    ready = queue.Queue()
+
+    def produce():
+        ready.put(("chunk", "b.wav", (0.0, np.zeros((4, 3), dtype=np.float32))))
+        for i in range(50):
+            ready.put(("chunk", "a.wav", (float(i), np.zeros((4, 5), dtype=np.float32))))
+            time.sleep(0.01)
+        ready.put(("exit", None, None))
+
+    producer = threading.Thread(target=produce)
+    start = time.perf_counter()
+    producer.start()
+    engine._consume(ready, 1)
+    producer.join()
+
+    #The lone (4, 3) chunk is run once its max_wait is up, not after the (4, 5) stream ends half a second later
+    shape, run_time = runs[0]
+    assert shape == (1, 4, 3)
+    assert run_time - start < 0.3
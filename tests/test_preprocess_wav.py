@@ -0,0 +1,17 @@
+import os
+
+from scripts.preprocess_wav import file_signature, is_done
+
+
+def test_evicted_shard_is_not_done(tmp_path):
+    recording = tmp_path / "20240605_184000.wav"
+    recording.write_bytes(b"audio")
+    shard = tmp_path / "shard.npy"
+    shard.write_bytes(b"spectrograms")
+
+    entry = {"file": str(recording), "signature": file_signature(str(recording)), "mode": "full",
+             "status": "done", "n_chunks": 10, "shard": str(shard)}
+    assert is_done(entry, str(recording))
+
+    os.remove(shard)
+    assert not is_done(entry, str(recording))
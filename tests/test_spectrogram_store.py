@@ -0,0 +1,82 @@
+import os
+import threading
+
+import numpy as np
+
+from src.SpectrogramStore import SpectrogramStore, shard_state
+
+PARAMS = {"mode": "chunk", "sample_rate": 48000}
+
+
+def make_source(tmp_path, name):
+    #The store only hashes the file's bytes, it doesn't need to be real audio
+    path = tmp_path / name
+    path.write_bytes(name.encode("utf-8"))
+    return str(path)
+
+
+def put_with_timeout(store, *args, timeout=10):
+    errors = []
+
+    def put():
+        try:
+            store.put_chunk(*args)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=put, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "put_chunk deadlocked"
+    if errors:
+        raise errors[0]
+
+
+def test_put_chunk_over_budget_evicts_without_deadlock(tmp_path):
+    store = SpectrogramStore(root=str(tmp_path / "store"), max_bytes=1000)
+    first, second = make_source(tmp_path, "a.wav"), make_source(tmp_path, "b.wav")
+    spectrogram = np.ones((8, 8), dtype=np.float32)
+
+    put_with_timeout(store, first, PARAMS, 0, spectrogram, 2)
+    put_with_timeout(store, first, PARAMS, 1, spectrogram, 2)
+    put_with_timeout(store, second, PARAMS, 0, spectrogram, 2)
+
+    #The complete, older shard is evicted to make room, the one being filled is kept
+    assert store.get_chunk(first, PARAMS, 0) is None
+    np.testing.assert_array_equal(store.get_chunk(second, PARAMS, 0), spectrogram)
+
+
+def test_put_chunk_into_complete_shard(tmp_path):
+    store = SpectrogramStore(root=str(tmp_path / "store"), max_bytes=None)
+    source = make_source(tmp_path, "a.wav")
+    spectrograms = np.zeros((3, 8, 8), dtype=np.float32)
+    store.save(source, PARAMS, spectrograms)
+
+    replacement = np.full((8, 8), 2.0, dtype=np.float32)
+    put_with_timeout(SpectrogramStore(root=store.root, max_bytes=None), source, PARAMS, 1, replacement, 3)
+
+    np.testing.assert_array_equal(store.load(source, PARAMS)[1], replacement)
+
+
+def test_shard_being_filled_is_never_complete(tmp_path):
+    store = SpectrogramStore(root=str(tmp_path / "store"), max_bytes=None)
+    source = make_source(tmp_path, "a.wav")
+    spectrogram = np.ones((8, 8), dtype=np.float32)
+    path = store.shard_path(source, PARAMS)
+
+    store.put_chunk(source, PARAMS, 0, spectrogram, 2)
+    assert shard_state(path) == "partial"
+    assert store.load(source, PARAMS) is None
+
+    store.put_chunk(source, PARAMS, 1, spectrogram, 2)
+    assert shard_state(path) == "complete"
+
+
+def test_save_leaves_no_temporary_files(tmp_path):
+    store = SpectrogramStore(root=str(tmp_path / "store"), max_bytes=None)
+    source = make_source(tmp_path, "a.wav")
+    path = store.shard_path(source, PARAMS)
+
+    store.save(source, PARAMS, np.zeros((3, 8, 8), dtype=np.float32))
+
+    assert sorted(os.listdir(os.path.dirname(path))) == sorted([os.path.basename(path), os.path.basename(path)[:-len(".npy")] + ".json"])
@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.TrainingLoader import TrainingLoader
+
+
+def make_samples(tmp_path, n_recordings=4, n_chunks=10, n_classes=3):
+    """Shards whose rows are filled with a unique sample id, every row labelled."""
+    samples = []
+    for recording in range(n_recordings):
+        ids = recording*n_chunks + np.arange(n_chunks, dtype=np.float32)
+        path = str(tmp_path / f"shard_{recording}.npy")
+        np.save(path, np.broadcast_to(ids[:, None, None], (n_chunks, 4, 5)).copy())
+
+        targets = np.zeros((n_chunks, n_classes), dtype=np.float32)
+        targets[:, recording % n_classes] = 1.0
+        samples.append((path, np.arange(n_chunks), targets))
+
+    return samples
+
+
+def test_kept_batches_hold_every_sample(tmp_path):
+    loader = TrainingLoader(make_samples(tmp_path), batch_size=4, shuffle_buffer=8, workers=0, to_torch=False, db=False)
+
+    batches = list(loader)
+    ids = np.concatenate([spectrograms[:, 0, 0] for spectrograms, _ in batches])
+
+    assert len(batches) == len(loader) == 10
+    np.testing.assert_array_equal(np.sort(ids), np.arange(40))
+
+
+def test_default_shuffle_buffer_is_bounded_by_the_samples(tmp_path):
+    loader = TrainingLoader(make_samples(tmp_path), workers=0, to_torch=False)
+
+    assert loader.shuffle_buffer == 40
@@ -0,0 +1,49 @@
+import numpy as np
+
+from src.WavController import WavController
+
+SAMPLE_RATE = 22050
+
+
+def controller(audio):
+    wav_controller = WavController()
+    wav_controller.audio_data, wav_controller.sample_rate = audio.astype(np.float32), SAMPLE_RATE
+    return wav_controller
+
+
+def noise(seconds, seed=0):
+    return 0.001*np.random.default_rng(seed).standard_normal(int(seconds*SAMPLE_RATE))
+
+
+def add_calls(audio, call_times, call_seconds=0.15, freq=3000.0):
+    t = np.arange(int(call_seconds*SAMPLE_RATE))/SAMPLE_RATE
+    call = 0.1*np.sin(2*np.pi*freq*t)*np.hanning(len(t))
+    for time in call_times:
+        i = int(time*SAMPLE_RATE)
+        audio[i:i+len(call)] += call[:len(audio) - i]
+    return audio
+
+
+def test_dense_calls_are_all_kept():
+    #120 calls a minute, every chunk has several
+    audio = add_calls(noise(60), np.arange(0.1, 59.8, 0.5))
+    active = controller(audio).detect_activity()
+
+    assert len(active) == 58
+    assert active.all()
+
+
+def test_quiet_chunks_are_skipped():
+    audio = add_calls(noise(60), [30.2])
+    wav_controller = controller(audio)
+    active = wav_controller.detect_activity()
+
+    #Only the three chunks covering the call at 30.2s
+    np.testing.assert_array_equal(np.flatnonzero(active), [28, 29, 30])
+    assert wav_controller.activity_report["skipped"] == 55
+
+
+def test_one_chunk_recording_is_kept():
+    active = controller(noise(3)).detect_activity()
+
+    np.testing.assert_array_equal(active, [True])